@@ -14,6 +14,7 @@ from gui.defaults import Defaults
 from gui.pp_helpers.context_menu import ContextMenu
 from rm_api.storage.v3 import get_file_contents, get_file, make_files_request
 from rm_lines import rm_bytes_to_svg
+from rm_lines.blocks import Block, BlockIndex
 
 if TYPE_CHECKING:
     from rm_api.models import Document
@@ -40,6 +41,11 @@ class DocumentDebugPopup(ContextMenu):
             "icon": "star",
             "action": 'render_important'
         },
+        {
+            "text": "List blocks",
+            "icon": "info",
+            "action": 'list_blocks'
+        },
         {
             "text": "Copy UUID",
             "icon": "copy",
@@ -141,13 +147,7 @@ class DocumentDebugPopup(ContextMenu):
                     data = json.dumps(json.loads(data), indent=4, sort_keys=True).encode()
                 f.write(data)
 
-    def render_pages(self, important: bool = False):
-        if important:
-            location = self.important_extract_location
-        else:
-            location = self.extract_location
-        self.clean_extract_location(location)
-        i = 0
+    def page_files(self):
         files = [file for file in self.document.files if file.uuid.endswith('.rm')]
         try:
             files.sort(key=lambda file: self.document.content.c_pages.get_index_from_uuid(
@@ -155,8 +155,17 @@ class DocumentDebugPopup(ContextMenu):
         except Exception as e:
             print_exc()
             pass
+        return files
+
+    def render_pages(self, important: bool = False):
+        if important:
+            location = self.important_extract_location
+        else:
+            location = self.extract_location
+        self.clean_extract_location(location)
+        i = 0
 
-        for file in files:
+        for file in self.page_files():
             data: bytes = get_file_contents(self.api, file.hash, binary=True, use_cache=False)
             file_path = os.path.join(location, f'{i:>03} {self.clean_file_uuid(file)}.svg')
 
@@ -172,5 +181,24 @@ class DocumentDebugPopup(ContextMenu):
     def render_important(self):
         self.render_pages(True)
 
+    def list_blocks(self):
+        self.clean_extract_location()
+
+        for i, file in enumerate(self.page_files()):
+            data: bytes = get_file_contents(self.api, file.hash, binary=True, use_cache=False)
+            file_path = os.path.join(self.extract_location, f'{i:>03} {self.clean_file_uuid(file)}.blocks.txt')
+
+            # Only the block headers are read, none of the blocks are parsed
+            try:
+                index = BlockIndex(data)
+                with open(file_path, 'w') as f:
+                    for info in index.infos:
+                        block_class = Block.lookup(info.block_type)
+                        f.write(f'{info.offset:>8} {info.size:>8} 0x{info.block_type:02X} '
+                                f'v{info.min_version}-{info.current_version} '
+                                f'{block_class.__name__ if block_class else "Unknown"}\n')
+            except Exception as e:
+                print_exc()
+
     def copy_uuid(self):
         pyperclip.copy(self.document.uuid)
@@ -7,6 +7,8 @@ import pygameextra as pe
 
 from gui.defaults import Defaults
 from gui.screens.viewer.renderers.notebook.rm_lines import Notebook_rM_Lines_Renderer
+from gui.screens.viewer.renderers.notebook.rm_lines_process import Notebook_rM_Lines_Process_Renderer
+from gui.screens.viewer.renderers.notebook.rm_lines_raster import Notebook_rM_Lines_Raster_Renderer
 from rm_api import Document
 from rm_api.models import Page
 from rm_api.storage.common import FileHandle
@@ -149,9 +151,17 @@ class PreviewHandler:
             rm_bytes = get_file_contents(document.api, file_hash, binary=True)
             if not rm_bytes:
                 raise Exception('Page content unavailable to construct preview')
-            image = Notebook_rM_Lines_Renderer.generate_expanded_notebook_from_rm(document.metadata, rm_bytes,
-                                                                                  use_lock=cls.PYGAME_THREAD_LOCK).get_frame_from_initial(
-                0, 0)
+            if pe.settings.config.notebook_render_mode == 'rm_lines_raster_inker':
+                renderer = Notebook_rM_Lines_Raster_Renderer
+            elif pe.settings.config.notebook_render_mode == 'rm_lines_process_inker':
+                renderer = Notebook_rM_Lines_Process_Renderer
+            else:
+                renderer = Notebook_rM_Lines_Renderer
+            # Render straight at the preview size, with simplified strokes
+            image = renderer.generate_expanded_notebook_from_rm(document.metadata, rm_bytes,
+                                                                use_lock=cls.PYGAME_THREAD_LOCK,
+                                                                lod_size=Defaults.PREVIEW_SIZE).get_frame_from_initial(
+                0, 0, *Defaults.PREVIEW_SIZE)
             image.resize(Defaults.PREVIEW_SIZE)
         else:
             image = None
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+
+class BudgetCache:
+    """
+    A least recently used cache that evicts the oldest entries once the
+    sizes of its entries, as measured by `sizeof`, add up to more than the budget.
+    `on_evict` is called with each entry that is evicted or replaced.
+    The most recent entry is always kept, even if it is over the budget.
+    """
+
+    def __init__(self, budget: int, sizeof: Callable[[Any], int],
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.budget = budget
+        self.used = 0
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, key: Hashable):
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: Hashable, value):
+        self.put(key, value)
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value):
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                evicted.append((key, self._pop(key)))
+            size = self.sizeof(value)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.used += size
+            while self.used > self.budget and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                evicted.append((oldest, self._pop(oldest)))
+        self._evicted(evicted, value)
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._pop(key)
+        self._evicted([(key, value)])
+        return value
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]):
+        """Remove the entries with keys matching `predicate`"""
+        with self._lock:
+            evicted = [(key, self._pop(key)) for key in [key for key in self._entries if predicate(key)]]
+        self._evicted(evicted)
+
+    def clear(self):
+        self.discard_where(lambda key: True)
+
+    def keys(self) -> Iterator[Hashable]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def values(self) -> Iterator[Any]:
+        with self._lock:
+            return iter(list(self._entries.values()))
+
+    def _pop(self, key: Hashable):
+        self.used -= self._sizes.pop(key)
+        return self._entries.pop(key)
+
+    def _evicted(self, evicted, kept=None):
+        if self.on_evict is None:
+            return
+        for key, value in evicted:
+            # A value put again under another key is still in use
+            if value is not kept:
+                self.on_evict(key, value)
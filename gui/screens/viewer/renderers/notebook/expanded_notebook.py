@@ -1,13 +1,36 @@
+import itertools
+import math
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
+import pygameextra as pe
+from gui.screens.viewer.renderers.notebook.tile_cache import TILE_CACHE
+from gui.screens.viewer.renderers.render_executor import RENDER_EXECUTOR
 from rm_lines.inker.document_size_tracker import NotebookSizeTracker
 
+_page_keys = itertools.count()
+
 
 class ExpandedNotebook(ABC):
+    # The width and height of a tile in pixels
+    TILE_SIZE = 256
+    # How many rendered frames each notebook keeps
+    FRAME_CACHE_SIZE = 4
+
     def __init__(self, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker):
         self.frame_width = frame_width
         self.frame_height = frame_height
         self.track_xy = track_xy
+        # Identifies the tiles of this notebook in the shared tile cache
+        self.page_key = next(_page_keys)
+        self._frames: OrderedDict[Tuple[int, int, int, int], pe.Image] = OrderedDict()
+        self._frames_lock = threading.Lock()
+        # Set once the notebook is evicted or replaced, what it renders after that isn't cached
+        self.freed = False
+        # The sizes `warm_tiles` failed for, which aren't tried again
+        self._failed_sizes = set()
 
     def get_frames(self, area_x: int, area_y: int, area_width: int, area_height: int):
         visible_frames = []
@@ -36,6 +59,131 @@ class ExpandedNotebook(ABC):
             for frame in visible_frames
         ]
 
+    def get_frame_from_initial(self, frame_x, frame_y, final_width: int = None, final_height: int = None) -> pe.Image:
+        """
+        Render a frame to `final_width` and `final_height`, which default to the size of the drawing,
+        keeping the last FRAME_CACHE_SIZE frames
+        """
+        if final_width is None:
+            final_width = int(self.track_xy.track_width)
+        if final_height is None:
+            final_height = int(self.track_xy.track_height)
+
+        key = (frame_x, frame_y, final_width, final_height)
+        with self._frames_lock:
+            if (frame := self._frames.get(key)) is not None:
+                self._frames.move_to_end(key)
+                return frame
+
+        frame = self.render_view((frame_x * self.frame_width - self.track_xy.offset_x,
+                                  frame_y * self.frame_height - self.track_xy.offset_y,
+                                  self.frame_width, self.frame_height),
+                                 (final_width, final_height))
+        with self._frames_lock:
+            if self.freed:
+                return frame
+            self._frames[key] = frame
+            while len(self._frames) > self.FRAME_CACHE_SIZE:
+                self._frames.popitem(last=False)
+        return frame
+
     @abstractmethod
-    def get_frame_from_initial(self, frame_x, frame_y, final_width: int = None, final_height: int = None):
+    def source_size(self) -> int:
+        """The approximate memory used by what the notebook renders from, in bytes"""
         ...
+
+    @abstractmethod
+    def render_view(self, view: Tuple[float, float, float, float], size: Tuple[int, int]) -> pe.Image:
+        """Render the area `view` (x, y, width, height) of the notebook to an image of `size`"""
+        ...
+
+    def render_tile(self, zoom: float, tile_x: int, tile_y: int) -> pe.Image:
+        """Render the tile at (tile_x, tile_y) of the grid of TILE_SIZE pixel tiles at `zoom`"""
+        span = self.TILE_SIZE / zoom
+        return self.render_view((tile_x * span, tile_y * span, span, span), (self.TILE_SIZE, self.TILE_SIZE))
+
+    def get_tile(self, zoom: float, tile_x: int, tile_y: int, render: bool = True) -> Optional[pe.Image]:
+        """
+        Return the tile at (tile_x, tile_y) of the grid of TILE_SIZE pixel tiles
+        at `zoom` pixels per notebook unit, rendering it if it isn't cached and `render` is set
+        """
+        key = (self.page_key, zoom, tile_x, tile_y)
+        if (tile := TILE_CACHE.get(key)) is None and render:
+            tile = self.render_tile(zoom, tile_x, tile_y)
+            TILE_CACHE.put(key, tile)
+            # Freed while rendering, `free` might have discarded the tiles before this one was put
+            if self.freed:
+                TILE_CACHE.pop(key)
+        return tile
+
+    def get_tiles(self, area_x: float, area_y: float, area_width: float, area_height: float,
+                  zoom: float, render: bool = True) -> List[Tuple[int, int, Optional[pe.Image]]]:
+        """
+        Return the tiles covering an area of the notebook, with their pixel
+        positions relative to the top left of the area at `zoom`.
+        Tiles that aren't cached are None unless `render` is set
+        """
+        zoom = round(zoom, 4)
+        span = self.TILE_SIZE / zoom
+        base_x = round(area_x * zoom)
+        base_y = round(area_y * zoom)
+        return [
+            (tile_x * self.TILE_SIZE - base_x, tile_y * self.TILE_SIZE - base_y,
+             self.get_tile(zoom, tile_x, tile_y, render))
+            for tile_y in range(math.floor(area_y / span), math.ceil((area_y + area_height) / span))
+            for tile_x in range(math.floor(area_x / span), math.ceil((area_x + area_width) / span))
+        ]
+
+    def fit_frame(self, width: int, height: int) -> Tuple[float, float, float, float, float, float, float]:
+        """
+        Return the area of the first frame, the zoom to fit it in `width` and
+        `height`, and the pixel position to center it at
+        """
+        area_x = -self.track_xy.offset_x
+        area_y = -self.track_xy.offset_y
+        zoom = round(min(width / self.frame_width, height / self.frame_height), 4)
+        x = round((width - self.frame_width * zoom) / 2)
+        y = round((height - self.frame_height * zoom) / 2)
+        return area_x, area_y, self.frame_width, self.frame_height, zoom, x, y
+
+    def display_tiles(self, width: int, height: int):
+        """
+        Display the first frame fit in `width` and `height` from tiles, clipped to the frame.
+        Tiles that aren't cached are rendered in the background and show up once ready
+        """
+        area_x, area_y, area_width, area_height, zoom, x, y = self.fit_frame(width, height)
+        clip = pe.Rect(x, y, round(area_width * zoom), round(area_height * zoom))
+        missing = False
+        for tile_x, tile_y, tile in self.get_tiles(area_x, area_y, area_width, area_height, zoom, render=False):
+            if tile is None:
+                missing = True
+                continue
+            tile_rect = pe.Rect(x + tile_x, y + tile_y, tile.width, tile.height)
+            visible = tile_rect.clip(clip)
+            if visible.width and visible.height:
+                tile.display(visible.topleft, (visible.x - tile_rect.x, visible.y - tile_rect.y,
+                                               visible.width, visible.height))
+        if missing and not self.freed and (width, height) not in self._failed_sizes:
+            RENDER_EXECUTOR.submit((self.page_key, width, height), self._warm_tiles_in_background, width, height)
+
+    def warm_tiles(self, width: int, height: int):
+        """Render the tiles of `display_tiles` ahead of time"""
+        if self.freed:
+            return
+        area_x, area_y, area_width, area_height, zoom, _, _ = self.fit_frame(width, height)
+        self.get_tiles(area_x, area_y, area_width, area_height, zoom)
+
+    def _warm_tiles_in_background(self, width: int, height: int):
+        try:
+            self.warm_tiles(width, height)
+        except Exception:
+            # Otherwise `display_tiles` queues it again every frame, the executor reports the error
+            self._failed_sizes.add((width, height))
+            raise
+
+    def free(self):
+        """Drop the rendered frames and tiles of this notebook, and stop caching them"""
+        with self._frames_lock:
+            self.freed = True
+            self._frames.clear()
+        TILE_CACHE.discard(self.page_key)
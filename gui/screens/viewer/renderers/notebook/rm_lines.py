@@ -1,62 +1,47 @@
-from functools import lru_cache
 import threading
-import re
 from io import BytesIO
 from traceback import print_exc
-from typing import Dict, Tuple, Union
+from typing import Iterator, Optional, Tuple
 
 import pygameextra as pe
+from gui.screens.viewer.renderers.budget_cache import BudgetCache
 from gui.screens.viewer.renderers.notebook.expanded_notebook import ExpandedNotebook
+from gui.screens.viewer.renderers.render_executor import RENDER_EXECUTOR
 from gui.screens.viewer.renderers.shared_model import AbstractRenderer
 from rm_api.models import Metadata
-from rm_lines import rm_bytes_to_svg
+from rm_lines import rm_tree_to_svg
+from rm_lines.blocks import iter_read_tree, read_tree
 from rm_lines.inker.document_size_tracker import NotebookSizeTracker, PDFSizeTracker
+from rm_lines.inker.svg import svg_header
+from rm_lines.scene_tree import SceneTree
 
 
 class rM_Lines_ExpandedNotebook(ExpandedNotebook):
-    WIDTH_PATTERN = r'width="([\d.]+)"'
-    HEIGHT_PATTERN = r'height="([\d.]+)"'
-    VIEWPORT_PATTERN = r'viewBox="([\d.-]+) ([\d.-]+) ([\d.]+) ([\d.]+)"'
-
-    def __init__(self, svg: str, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker,
+    def __init__(self, svg_body: str, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker,
                  use_lock: threading.Lock = None):
+        """
+        `svg_body` is the SVG without its header, which is generated for each view
+        """
         super().__init__(frame_width, frame_height, track_xy)
-        self.svg = svg
+        self.svg_body = svg_body.encode()
         self.use_lock = use_lock
 
-    @lru_cache()
-    def get_frame_from_initial(self, frame_x, frame_y, final_width: int = None, final_height: int = None) -> pe.Image:
-        # Replace the svg viewport with a viewport to capture the frame
-
-        # TODO: move these to __init__ or property setter of svg
-        width_match = re.search(self.WIDTH_PATTERN, self.svg)
-        height_match = re.search(self.HEIGHT_PATTERN, self.svg)
-        viewbox_match = re.search(self.VIEWPORT_PATTERN, self.svg)
-
-        width = float(width_match.group(1))
-        height = float(height_match.group(1))
-        x = float(viewbox_match.group(1))
-        y = float(viewbox_match.group(2))
-        w = float(viewbox_match.group(3))
-        h = float(viewbox_match.group(4))
-
-        if final_width is None:
-            final_width = int(width)
-        if final_height is None:
-            final_height = int(height)
-
-        # Replace values in the SVG content
-        svg_content = re.sub(self.WIDTH_PATTERN, f'width="{final_width}"', self.svg)
-        svg_content = re.sub(self.HEIGHT_PATTERN, f'height="{final_height}"', svg_content)
-        svg_content = re.sub(self.VIEWPORT_PATTERN,
-                             f'viewBox="'
-                             f'{frame_x * self.frame_width - self.track_xy.offset_x} '
-                             f'{frame_y * self.frame_height - self.track_xy.offset_y} '
-                             f'{self.frame_width} '
-                             f'{self.frame_height}"',
-                             svg_content)
-
-        encoded_svg_content = svg_content.encode()
+    def source_size(self) -> int:
+        return len(self.svg_body)
+
+    def render_tile(self, zoom: float, tile_x: int, tile_y: int) -> pe.Image:
+        # Each render parses the whole SVG body, cut the tiles out of a single frame at the zoom instead
+        frame = self.get_frame_from_initial(0, 0, round(self.frame_width * zoom), round(self.frame_height * zoom))
+        area = pe.Rect(tile_x * self.TILE_SIZE - round(-self.track_xy.offset_x * zoom),
+                       tile_y * self.TILE_SIZE - round(-self.track_xy.offset_y * zoom),
+                       self.TILE_SIZE, self.TILE_SIZE)
+        tile = pe.pygame.Surface((self.TILE_SIZE, self.TILE_SIZE), pe.pygame.SRCALPHA)
+        tile.blit(frame.surface.surface, (0, 0), area)
+        return pe.Image(tile)
+
+    def render_view(self, view: Tuple[float, float, float, float], size: Tuple[int, int]) -> pe.Image:
+        final_width, final_height = size
+        encoded_svg_content = svg_header(final_width, final_height, view).encode() + self.svg_body
         # if self.use_lock:
         #     with self.use_lock:
         #         return pe.Image(BytesIO(encoded_svg_content), (final_width, final_height))
@@ -73,22 +58,71 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
     This renderer is also used for debug rendering and previews
     """
 
-    pages: Dict[str, Union[rM_Lines_ExpandedNotebook, None]]
+    pages: BudgetCache  # Of Union[rM_Lines_ExpandedNotebook, None] by .rm file
     RENDER_ERROR = 'Error rendering writing for this page'
+    NOT_LOADED = object()
+
+    # Publish a partial render of a page once this many blocks or milliseconds of it are parsed
+    PROGRESSIVE_BLOCKS = 2000
+    PROGRESSIVE_MS = 250
+
+    # Render this many pages ahead of and behind the current page
+    PREFETCH_PAGES = 2
+    # Memory budget for the rendered pages of a document, not counting their tiles
+    PAGES_BUDGET = 128 * 1024 * 1024
 
     def __init__(self, document_renderer):
         super().__init__(document_renderer)
-        self.pages = {}
+        self.pages = BudgetCache(self.PAGES_BUDGET, self._page_size, self._page_evicted)
+        # The pages the loading indicator is waiting for
+        self._waiting = set()
+        self._waiting_lock = threading.Lock()
+        self._current_page = None
+        self._current_index = None
+        self._closed = False
 
-    def _load(self, page_uuid: str):
-        if content := self.document.content_data.get(file_uuid := f'{self.document.uuid}/{page_uuid}.rm'):
-            self.pages[file_uuid] = self.generate_expanded_notebook_from_rm(self.document.metadata, content,
-                                                                            size=self.size)
-        self.document_renderer.loading -= 1
+    @staticmethod
+    def _page_size(expanded: Optional[rM_Lines_ExpandedNotebook]) -> int:
+        return expanded.source_size() if expanded is not None else 0
+
+    @staticmethod
+    def _page_evicted(file_uuid: str, expanded: Optional[rM_Lines_ExpandedNotebook]):
+        if expanded is not None:
+            expanded.free()
+
+    def _load(self, file_uuid: str):
+        loaded = False
+        try:
+            if content := self.document.content_data.get(file_uuid):
+                for expanded in self.generate_progressive_notebooks_from_rm(self.document.metadata, content,
+                                                                            size=self.size):
+                    if self._closed:
+                        if expanded is not None:
+                            expanded.free()
+                        break
+                    self.pages[file_uuid] = expanded
+                    if not loaded:
+                        # Stop the loading indicator as soon as there is something to show
+                        loaded = True
+                        self._loaded(file_uuid)
+        finally:
+            if not loaded:
+                self._loaded(file_uuid)
+
+    def _loaded(self, file_uuid: str):
+        with self._waiting_lock:
+            if file_uuid in self._waiting:
+                self._waiting.discard(file_uuid)
+                self.document_renderer.loading -= 1
+
+    def _schedule(self, file_uuid: str):
+        # Pages are keyed by renderer in the shared executor, a page queued or loading isn't loaded again
+        if file_uuid not in self.pages:
+            RENDER_EXECUTOR.submit((self, file_uuid), self._load, file_uuid)
 
     def load(self):
         self.check_and_load_page(self.document.content.c_pages.last_opened.value)
-        self.document_renderer.loading -= 1  # check_and_load_page adds an extra loading
+        self.document_renderer.loading -= 1  # The document renderer adds an extra loading
 
     def handle_event(self, event):
         pass
@@ -96,13 +130,18 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
     def render(self, page_uuid: str):
         page = self.document.content.c_pages.get_page_from_uuid(page_uuid)
         rm_file = f'{self.document.uuid}/{page.id}.rm'
-
-        if rm_file in self.pages:
-            if self.pages[rm_file] is None:
+        if page_uuid != self._current_page:
+            self._current_page = page_uuid
+            self.prefetch(page_uuid)
+
+        # A single lookup, the page can be evicted by a worker at any time
+        expanded = self.pages.get(rm_file, self.NOT_LOADED)
+        if expanded is not self.NOT_LOADED:
+            if expanded is None:
                 self.error = self.RENDER_ERROR
             else:
-                # TODO: replace with get frames and use offsets and aknowledge each frame offset when displaying
-                self.pages[rm_file].get_frame_from_initial(0, 0, *self.size).display()
+                # TODO: use offsets and aknowledge each frame offset when displaying
+                expanded.display_tiles(*self.size)
                 if self.error and self.error.text == self.RENDER_ERROR:
                     self.error = None
         elif self.error and self.error.text == self.RENDER_ERROR:
@@ -111,25 +150,99 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
             self.check_and_load_page(page_uuid)
 
     def check_and_load_page(self, page_uuid: str):
-        self.document_renderer.loading += 1
-        threading.Thread(target=self._load, args=(page_uuid,), daemon=True).start()
+        """Load a page, showing the loading indicator until it can be displayed"""
+        file_uuid = f'{self.document.uuid}/{page_uuid}.rm'
+        with self._waiting_lock:
+            if file_uuid in self.pages or file_uuid in self._waiting:
+                return
+            self._waiting.add(file_uuid)
+            self.document_renderer.loading += 1
+            self._schedule(file_uuid)
+
+    def prefetch(self, page_uuid: str):
+        """
+        Render the pages around a page in the background, the pages in the
+        direction of navigation first, dropping the queued pages that are no longer near
+        """
+        pages = self.document.content.c_pages.pages
+        index = self.document.content.c_pages.get_index_from_uuid(page_uuid)
+        if index is None:
+            return
+        direction = -1 if self._current_index is not None and index < self._current_index else 1
+        self._current_index = index
+
+        order = [index]
+        order.extend(index + distance * direction for distance in range(1, self.PREFETCH_PAGES + 1))
+        order.extend(index - distance * direction for distance in range(1, self.PREFETCH_PAGES + 1))
+        file_uuids = [
+            file_uuid for position in order
+            if 0 <= position < len(pages) and
+            (file_uuid := f'{self.document.uuid}/{pages[position].id}.rm') in self.document.content_files
+        ]
+
+        with self._waiting_lock:
+            # Cancel the pages that haven't started, to queue them again by priority or drop them
+            RENDER_EXECUTOR.cancel_where(lambda key: key[0] is self and key[1] not in self._waiting)
+            for file_uuid in file_uuids:
+                self._schedule(file_uuid)
 
     @staticmethod
-    def generate_expanded_notebook_from_rm(metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
-                                           use_lock: threading.Lock = None) -> rM_Lines_ExpandedNotebook:
+    def _expanded_notebook_from_tree(metadata: Metadata, tree: SceneTree, size: Tuple[int, int] = None,
+                                     use_lock: threading.Lock = None,
+                                     lod_size: Tuple[int, int] = None) -> rM_Lines_ExpandedNotebook:
+        if metadata.type == 'DocumentType':
+            track_xy = NotebookSizeTracker()
+        else:
+            track_xy = PDFSizeTracker()
+        # A notebook that is only drawn small, like a preview, gets simplified strokes
+        lod_scale = None
+        if lod_size:
+            lod_scale = min(lod_size[0] / track_xy.frame_width, lod_size[1] / track_xy.frame_height)
+        svg_body: str = rm_tree_to_svg(tree, track_xy, compact=True, lod_scale=lod_scale, header=False)
+        expanded = rM_Lines_ExpandedNotebook(svg_body, track_xy.frame_width, track_xy.frame_height, track_xy,
+                                             use_lock)
+        if size:
+            expanded.warm_tiles(*size)
+        else:
+            expanded.get_frame_from_initial(0, 0, *(lod_size or ()))
+        return expanded
+
+    @classmethod
+    def generate_expanded_notebook_from_rm(cls, metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
+                                           use_lock: threading.Lock = None,
+                                           lod_size: Tuple[int, int] = None) -> rM_Lines_ExpandedNotebook:
+        """
+        Render a page, `lod_size` being the size of the frame for a notebook
+        that is only ever drawn at that size, so that its strokes can be simplified
+        """
         try:
-            if metadata.type == 'DocumentType':
-                track_xy = NotebookSizeTracker()
-            else:
-                track_xy = PDFSizeTracker()
-            svg: str = rm_bytes_to_svg(content, track_xy)
-            expanded = rM_Lines_ExpandedNotebook(svg, track_xy.frame_width, track_xy.frame_height, track_xy, use_lock)
-            expanded.get_frame_from_initial(0, 0, *(size if size else ()))
+            return cls._expanded_notebook_from_tree(metadata, read_tree(content), size, use_lock, lod_size)
         except Exception as e:
             print_exc()
             return None
-        else:
-            return expanded
+
+    @classmethod
+    def generate_progressive_notebooks_from_rm(cls, metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
+                                               use_lock: threading.Lock = None) \
+            -> Iterator[Optional[rM_Lines_ExpandedNotebook]]:
+        """
+        Yield a notebook rendered from the first part of the page that is parsed,
+        then one of the complete page, or None if the page failed to render
+        """
+        try:
+            trees = iter_read_tree(content, cls.PROGRESSIVE_BLOCKS, cls.PROGRESSIVE_MS)
+            yield cls._expanded_notebook_from_tree(metadata, next(trees), size, use_lock)
+            # Inking every snapshot would redo the work of the ones before it, skip to the complete page
+            complete = None
+            for complete in trees:
+                pass
+            if complete is not None:
+                yield cls._expanded_notebook_from_tree(metadata, complete, size, use_lock)
+        except Exception as e:
+            print_exc()
+            yield None
 
     def close(self):
-        pass
+        self._closed = True
+        RENDER_EXECUTOR.cancel_where(lambda key: key[0] is self)
+        self.pages.clear()
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from traceback import print_exc
+from typing import Iterator, Optional, Tuple
+
+import pygameextra as pe
+from gui.screens.viewer.renderers.notebook.expanded_notebook import ExpandedNotebook
+from gui.screens.viewer.renderers.notebook.rm_lines import Notebook_rM_Lines_Renderer
+from rm_api.models import Metadata
+from rm_lines.inker.document_size_tracker import DocumentSizeTracker
+from rm_lines.inker.process_raster import SIZE_TRACKERS, render_rm, rgba_size
+
+# Leave a core for the GUI
+PROCESS_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Forking a process that runs pygame and threads isn't safe, start the workers fresh
+            _process_pool = ProcessPoolExecutor(PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def render_rm_in_process(content: bytes, tracker: str, size: Tuple[int, int]) \
+        -> Tuple[pe.pygame.Surface, DocumentSizeTracker]:
+    """
+    Render the first frame of a page to `size` in a worker process,
+    returning the frame and the size tracker of the page
+    """
+    shm = shared_memory.SharedMemory(create=True, size=rgba_size(size))
+    try:
+        track_xy = get_process_pool().submit(render_rm, content, tracker, size, shm.name).result()
+        frame = pe.pygame.image.frombuffer(shm.buf[:rgba_size(size)], size, 'RGBA')
+        # Copy the frame out of the shared memory so that it can be freed
+        surface = frame.copy()
+        del frame
+    finally:
+        shm.close()
+        shm.unlink()
+    return surface, track_xy
+
+
+class rM_Lines_ProcessExpandedNotebook(ExpandedNotebook):
+    """A notebook of the first frame of a page, rendered ahead of time in a worker process"""
+
+    def __init__(self, frame: pe.pygame.Surface, track_xy: DocumentSizeTracker):
+        super().__init__(track_xy.frame_width, track_xy.frame_height, track_xy)
+        self.frame = frame
+
+    def source_size(self) -> int:
+        return rgba_size(self.frame.get_size())
+
+    def render_view(self, view: Tuple[float, float, float, float], size: Tuple[int, int]) -> pe.Image:
+        view_x, view_y, view_width, view_height = view
+        scale_x = self.frame.get_width() / self.frame_width
+        scale_y = self.frame.get_height() / self.frame_height
+        # The part of the frame in the view
+        area = pe.Rect(round((view_x + self.track_xy.offset_x) * scale_x),
+                       round((view_y + self.track_xy.offset_y) * scale_y),
+                       round(view_width * scale_x), round(view_height * scale_y))
+        visible = area.clip(self.frame.get_rect())
+        surface = pe.pygame.Surface(size, pe.pygame.SRCALPHA)
+        if visible.width and visible.height:
+            part = self.frame.subsurface(visible)
+            position = (round((visible.x - area.x) * size[0] / area.width),
+                        round((visible.y - area.y) * size[1] / area.height))
+            if area.size != tuple(size):
+                part = pe.pygame.transform.smoothscale(part, (round(visible.width * size[0] / area.width),
+                                                              round(visible.height * size[1] / area.height)))
+            surface.blit(part, position)
+        return pe.Image(surface)
+
+
+# noinspection PyPep8Naming
+class Notebook_rM_Lines_Process_Renderer(Notebook_rM_Lines_Renderer):
+    """
+    A renderer for rM lines that parses and draws pages in worker processes,
+    keeping that work from holding the GIL away from the GUI
+    """
+
+    @classmethod
+    def generate_expanded_notebook_from_rm(cls, metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
+                                           use_lock: threading.Lock = None,
+                                           lod_size: Tuple[int, int] = None) -> rM_Lines_ProcessExpandedNotebook:
+        """
+        Render a page fit to `size`, or to `lod_size` for a notebook that is only ever drawn at that size
+        """
+        try:
+            tracker = 'notebook' if metadata.type == 'DocumentType' else 'pdf'
+            track_xy = SIZE_TRACKERS[tracker]()
+            frame_width, frame_height = track_xy.frame_width, track_xy.frame_height
+            if size:
+                zoom = round(min(size[0] / frame_width, size[1] / frame_height), 4)
+                frame_size = (round(frame_width * zoom), round(frame_height * zoom))
+            else:
+                frame_size = lod_size or (round(frame_width), round(frame_height))
+            frame, track_xy = render_rm_in_process(content, tracker, frame_size)
+            expanded = rM_Lines_ProcessExpandedNotebook(frame, track_xy)
+            if size:
+                expanded.warm_tiles(*size)
+            return expanded
+        except Exception as e:
+            print_exc()
+            return None
+
+    @classmethod
+    def generate_progressive_notebooks_from_rm(cls, metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
+                                               use_lock: threading.Lock = None) \
+            -> Iterator[Optional[rM_Lines_ProcessExpandedNotebook]]:
+        # The page is only sent back once it is complete
+        yield cls.generate_expanded_notebook_from_rm(metadata, content, size, use_lock)
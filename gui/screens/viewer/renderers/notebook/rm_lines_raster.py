@@ -0,0 +1,56 @@
+import threading
+from typing import Tuple
+
+import pygameextra as pe
+from gui.screens.viewer.renderers.notebook.expanded_notebook import ExpandedNotebook
+from gui.screens.viewer.renderers.notebook.rm_lines import Notebook_rM_Lines_Renderer
+from rm_api.models import Metadata
+from rm_lines.inker.document_size_tracker import NotebookSizeTracker, PDFSizeTracker
+from rm_lines.inker.raster import SceneIndex, tree_to_surface
+from rm_lines.inker.svg import track_tree
+from rm_lines.scene_tree import SceneTree
+
+
+# Approximate memory used by a point of a stroke, stored in a PointStore
+POINT_SIZE = 14
+
+
+class rM_Lines_RasterExpandedNotebook(ExpandedNotebook):
+    def __init__(self, tree: SceneTree, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker,
+                 use_lock: threading.Lock = None):
+        super().__init__(frame_width, frame_height, track_xy)
+        self.tree = tree
+        self.index = SceneIndex(tree)
+        self.use_lock = use_lock
+
+    def source_size(self) -> int:
+        return self.index.point_count * POINT_SIZE
+
+    def render_view(self, view: Tuple[float, float, float, float], size: Tuple[int, int]) -> pe.Image:
+        return pe.Image(tree_to_surface(self.tree, view, size, index=self.index))
+
+
+# noinspection PyPep8Naming
+class Notebook_rM_Lines_Raster_Renderer(Notebook_rM_Lines_Renderer):
+    """
+    A renderer for rM lines that draws the strokes straight to a surface
+    instead of going through SVG
+    """
+
+    @staticmethod
+    def _expanded_notebook_from_tree(metadata: Metadata, tree: SceneTree, size: Tuple[int, int] = None,
+                                     use_lock: threading.Lock = None,
+                                     lod_size: Tuple[int, int] = None) -> rM_Lines_RasterExpandedNotebook:
+        if metadata.type == 'DocumentType':
+            track_xy = NotebookSizeTracker()
+        else:
+            track_xy = PDFSizeTracker()
+        track_tree(tree, track_xy)
+        expanded = rM_Lines_RasterExpandedNotebook(tree, track_xy.frame_width, track_xy.frame_height, track_xy,
+                                                   use_lock)
+        # Strokes are simplified by the scale they are drawn at, see `SceneIndex.lod`
+        if size:
+            expanded.warm_tiles(*size)
+        else:
+            expanded.get_frame_from_initial(0, 0, *(lod_size or ()))
+        return expanded
@@ -0,0 +1,27 @@
+from typing import Hashable
+
+import pygameextra as pe
+from gui.screens.viewer.renderers.budget_cache import BudgetCache
+
+
+class TileCache(BudgetCache):
+    """
+    A least recently used cache of rendered tiles, shared by all pages,
+    that evicts the oldest tiles once the pixels held exceed the memory budget
+    """
+
+    def __init__(self, budget: int):
+        super().__init__(budget, self.tile_bytes)
+
+    @staticmethod
+    def tile_bytes(tile: pe.Image) -> int:
+        # Tiles are RGBA
+        return tile.width * tile.height * 4
+
+    def discard(self, page_key: Hashable):
+        """Remove the tiles of a page, the page being the first item of the keys"""
+        self.discard_where(lambda key: key[0] == page_key)
+
+
+# 256 MiB of tiles, about a thousand 256x256 tiles
+TILE_CACHE = TileCache(256 * 1024 * 1024)
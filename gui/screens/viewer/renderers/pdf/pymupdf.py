@@ -1,5 +1,9 @@
-from functools import lru_cache
+import threading
+from traceback import print_exc
+from typing import Optional, Tuple
+
 import pygameextra as pe
+from colorama import Fore
 
 # noinspection PyBroadException
 try:
@@ -8,29 +12,56 @@ except Exception:
     pymupdf = None
 
 from gui.defaults import Defaults
+from gui.events import ResizeEvent
+from ..budget_cache import BudgetCache
+from ..render_executor import RENDER_EXECUTOR
 from ..shared_model import AbstractRenderer
 
 
 # noinspection PyPep8Naming
 class PDF_PyMuPDF_Viewer(AbstractRenderer):
+    EVENT_HOOK_NAME = 'pymupdf_resize_check<{0}>'
+
+    # Render this many pages ahead of and behind the current page
+    PREFETCH_PAGES = 2
+    # The size of the placeholder shown while a page renders, relative to the page
+    PLACEHOLDER_SCALE = 0.25
+    # Memory budget for the rendered pages of a document
+    PAGES_BUDGET = 192 * 1024 * 1024
+    NOT_RENDERED = object()
+
     def __init__(self, document_renderer):
         super().__init__(document_renderer)
         self.current_page = self.document_renderer.current_page_index
+        self.pdf = None
+        self.page_count = 0
+        # Rendered pages by (page, size), None for the pages that failed to render
+        self.pages = BudgetCache(self.PAGES_BUDGET, self._page_bytes)
+        # PyMuPDF isn't thread safe, the pages render one at a time
+        self._pdf_lock = threading.Lock()
+        self._prefetched_page = None
+        # ((page, size), surface) of the placeholder being shown, scaled up once
+        self._scaled_placeholder = None
+        # Bumped when the cached pages are dropped, so that renders started before aren't stored
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self.gui.api.add_hook(self.EVENT_HOOK_NAME.format(id(self)), self.resize_check_hook)
 
-    @property
-    @lru_cache
-    def pdf_raw(self):
+    @staticmethod
+    def _page_bytes(image: Optional[pe.Surface]) -> int:
+        if image is None:
+            return 0
+        return image.size[0] * image.size[1] * 4
+
+    def load(self):
         try:
-            return self.document.content_data[f'{self.document.uuid}.pdf']
+            pdf_raw = self.document.content_data[f'{self.document.uuid}.pdf']
         except KeyError:
             self.error = 'PDF file missing'
-            return None
-
-    def load(self):
-        if not self.pdf_raw:
-            self.pdf = None
-        else:
-            self.pdf = pymupdf.open(stream=self.pdf_raw, filetype='pdf')
+            pdf_raw = None
+        if pdf_raw:
+            self.pdf = pymupdf.open(stream=pdf_raw, filetype='pdf')
+            self.page_count = self.pdf.page_count
         self.document_renderer.loading -= 1
 
     def render(self, page_uuid: str):
@@ -41,28 +72,105 @@ class PDF_PyMuPDF_Viewer(AbstractRenderer):
             return
 
         page_index = page.redirect.value
-        image = self.get_page(page_index)
+        size = tuple(self.size)
+        if page_index != self._prefetched_page:
+            self._prefetched_page = page_index
+            self.prefetch(page_index, size)
 
-        pe.display.blit(image, (0, 0))
+        # A single lookup, the page can be evicted by a worker at any time
+        image = self.pages.get((page_index, size), self.NOT_RENDERED)
+        if image is not self.NOT_RENDERED:
+            self._scaled_placeholder = None
+            if image:
+                pe.display.blit(image, (0, 0))
+            return
+        self.schedule(page_index, size)
+        if placeholder := self.scaled_placeholder(page_index, size):
+            pe.display.blit(placeholder, (0, 0))
+
+    def scaled_placeholder(self, page: int, size: Tuple[int, int]) -> Optional[pe.pygame.Surface]:
+        """Return the placeholder of a page scaled up to `size`, scaling it only once"""
+        if self._scaled_placeholder and self._scaled_placeholder[0] == (page, size):
+            return self._scaled_placeholder[1]
+        if not (placeholder := self.pages.get((page, self.placeholder_size(size)))):
+            return None
+        scaled = pe.pygame.transform.scale(placeholder.surface, size)
+        self._scaled_placeholder = ((page, size), scaled)
+        return scaled
 
-    @lru_cache()
-    def get_page(self, page):
-        pdf_page = self.pdf[page]
-        scale_x = self.width / pdf_page.rect.width
-        scale_y = self.height / pdf_page.rect.height
+    def placeholder_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        return max(1, round(size[0] * self.PLACEHOLDER_SCALE)), max(1, round(size[1] * self.PLACEHOLDER_SCALE))
 
-        # Create a matrix for scaling
-        matrix = pymupdf.Matrix(scale_x, scale_y)
+    def schedule(self, page: int, size: Tuple[int, int]):
+        if 0 <= page < self.page_count and (page, size) not in self.pages:
+            RENDER_EXECUTOR.submit((self, page, size), self._render_page, page, size, self._generation)
 
-        # noinspection PyUnresolvedReferences
-        pix = pdf_page.get_pixmap(matrix=matrix)
-        mode = "RGBA" if pix.alpha else "RGB"
-        # noinspection PyTypeChecker
-        image = pe.Surface(surface=pe.pygame.image.frombuffer(pix.samples, (pix.width, pix.height), mode))
-        return image
+    def prefetch(self, page: int, size: Tuple[int, int]):
+        """Render the pages around a page in the background, dropping the queued pages that are no longer near"""
+        RENDER_EXECUTOR.cancel_where(lambda key: key[0] is self)
+        self.schedule(page, size)
+        for distance in range(1, self.PREFETCH_PAGES + 1):
+            self.schedule(page + distance, size)
+            self.schedule(page - distance, size)
+
+    def _render_page(self, page: int, size: Tuple[int, int], generation: int):
+        # A quick low resolution render first, to show until the page is done
+        placeholder_size = self.placeholder_size(size)
+        if (page, placeholder_size) not in self.pages:
+            self._store(page, placeholder_size, self.get_page(page, placeholder_size), generation)
+        self._store(page, size, self.get_page(page, size), generation)
+
+    def _store(self, page: int, size: Tuple[int, int], image: Optional[pe.Surface], generation: int):
+        # Pages rendered before a resize or close are stale
+        with self._generation_lock:
+            if generation == self._generation:
+                self.pages[(page, size)] = image
+
+    def _drop_pages(self):
+        with self._generation_lock:
+            self._generation += 1
+            self.pages.clear()
+        self._scaled_placeholder = None
+        RENDER_EXECUTOR.cancel_where(lambda key: key[0] is self)
+
+    def get_page(self, page: int, size: Tuple[int, int]) -> Optional[pe.Surface]:
+        """Rasterise a page of the PDF stretched to `size`"""
+        try:
+            with self._pdf_lock:
+                if not self.pdf:
+                    return None
+                pdf_page = self.pdf[page]
+                scale_x = size[0] / pdf_page.rect.width
+                scale_y = size[1] / pdf_page.rect.height
+
+                # Create a matrix for scaling
+                matrix = pymupdf.Matrix(scale_x, scale_y)
+
+                # noinspection PyUnresolvedReferences
+                pix = pdf_page.get_pixmap(matrix=matrix)
+            mode = "RGBA" if pix.alpha else "RGB"
+            # noinspection PyTypeChecker
+            image = pe.Surface(surface=pe.pygame.image.frombuffer(pix.samples, (pix.width, pix.height), mode))
+            return image
+        except Exception:
+            # The page is left blank until the pages are dropped
+            print(f"{Fore.RED}Could not render page {page} of the PDF at {size}{Fore.RESET}")
+            print_exc()
+            return None
+
+    def resize_check_hook(self, event):
+        if isinstance(event, ResizeEvent):
+            # Pages rendered at the old size won't be shown again
+            self._drop_pages()
+            self._prefetched_page = None
 
     def close(self):
-        pass
+        self.gui.api.remove_hook(self.EVENT_HOOK_NAME.format(id(self)))
+        self._drop_pages()
+        with self._pdf_lock:
+            if self.pdf:
+                self.pdf.close()
+            self.pdf = None
 
     def handle_event(self, event):
         pass
@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from traceback import print_exception
+from typing import Callable, Dict, Hashable, Optional
+
+
+class RenderExecutor:
+    """
+    A fixed number of workers shared by the renderers.
+    Jobs are identified by a key, submitting a key that is already
+    queued or running returns the future of that job instead of starting another.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='render')
+        self._jobs: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._jobs
+
+    def get(self, key: Hashable) -> Optional[Future]:
+        """Return the future of the job queued or running for `key`"""
+        return self._jobs.get(key)
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if (job := self._jobs.get(key)) is not None:
+                return job
+            job = self._executor.submit(fn, *args, **kwargs)
+            self._jobs[key] = job
+        # Outside the lock, a job that already finished calls back right away
+        job.add_done_callback(lambda _: self._done(key, job))
+        return job
+
+    def cancel_where(self, predicate: Callable[[Hashable], bool]):
+        """Cancel the queued jobs with keys matching `predicate`, the running jobs finish"""
+        with self._lock:
+            jobs = [job for key, job in self._jobs.items() if predicate(key)]
+        # Cancelling calls back, which takes the lock
+        for job in jobs:
+            job.cancel()
+
+    def _done(self, key: Hashable, job: Future):
+        with self._lock:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+        # Most results aren't looked at, report failures here so that they don't go unnoticed
+        if not job.cancelled() and (error := job.exception()) is not None:
+            print_exception(type(error), error, error.__traceback__)
+
+
+RENDER_EXECUTOR = RenderExecutor(2)
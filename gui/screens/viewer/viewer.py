@@ -7,6 +7,8 @@ from colorama import Fore
 
 from gui.screens.viewer.renderers.pdf.cef import PDF_CEF_Viewer
 from .renderers.notebook.rm_lines import Notebook_rM_Lines_Renderer
+from .renderers.notebook.rm_lines_process import Notebook_rM_Lines_Process_Renderer
+from .renderers.notebook.rm_lines_raster import Notebook_rM_Lines_Raster_Renderer
 from .renderers.pdf.pymupdf import PDF_PyMuPDF_Viewer
 from ...events import ResizeEvent
 
@@ -82,9 +84,14 @@ class DocumentRenderer(pe.ChildContext):
         self.last_opened_uuid = self.document.content.c_pages.last_opened.value
         self.current_page_index = self.document.content.c_pages.get_index_from_uuid(self.last_opened_uuid) or 0
         self.renderer = None
+        self.notebook_renderer = None
         super().__init__(parent)
         if self.config.notebook_render_mode == 'rm_lines_svg_inker':
             self.notebook_renderer = Notebook_rM_Lines_Renderer(self)
+        elif self.config.notebook_render_mode == 'rm_lines_raster_inker':
+            self.notebook_renderer = Notebook_rM_Lines_Raster_Renderer(self)
+        elif self.config.notebook_render_mode == 'rm_lines_process_inker':
+            self.notebook_renderer = Notebook_rM_Lines_Process_Renderer(self)
         else:
             self.close()
             print(f"{Fore.RED}Notebook render mode `{self.config.notebook_render_mode}` unavailable{Fore.RESET}")
@@ -216,6 +223,8 @@ class DocumentRenderer(pe.ChildContext):
     def close(self):
         if self.renderer:
             self.renderer.close()
+        if self.notebook_renderer:
+            self.notebook_renderer.close()
 
     def post_loop(self):
         if self.error:
@@ -1,3 +1,8 @@
-from gui import run_gui
+from multiprocessing import freeze_support
 
-run_gui()
+if __name__ == '__main__':
+    # Render worker processes import this file again, they shouldn't start the GUI
+    freeze_support()
+    from gui import run_gui
+
+    run_gui()
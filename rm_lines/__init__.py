@@ -1,15 +1,21 @@
-from io import BytesIO, StringIO
+from io import StringIO
 
 from rm_lines.inker.document_size_tracker import DocumentSizeTracker
 from .reader import read_tree
 from .inker import tree_to_svg
+from .scene_tree import SceneTree
 
 
-def rm_bytes_to_svg(data: bytes, track_xy: DocumentSizeTracker = None):
-    tree = read_tree(BytesIO(data))
+def rm_tree_to_svg(tree: SceneTree, track_xy: DocumentSizeTracker = None, compact: bool = False,
+                   debug: bool = None, lod_scale: float = None, header: bool = True):
     with StringIO() as f:
-        tree_to_svg(tree, f, track_xy)
+        tree_to_svg(tree, f, track_xy, compact, debug, lod_scale, header)
         return f.getvalue()
 
 
+def rm_bytes_to_svg(data: bytes, track_xy: DocumentSizeTracker = None, compact: bool = False,
+                    debug: bool = None, lod_scale: float = None):
+    return rm_tree_to_svg(read_tree(data), track_xy, compact, debug, lod_scale)
+
+
 __all__ = ['read_tree', 'tree_to_svg']
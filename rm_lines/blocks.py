@@ -7,8 +7,11 @@ With help from ddvk's v6 reader, and enum values from remt.
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from array import array
 from collections.abc import Iterable, Iterator
 import math
+import struct
+import time
 from uuid import UUID, uuid4
 from dataclasses import replace
 import logging
@@ -16,6 +19,11 @@ import typing as tp
 
 from packaging.version import Version
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .tagged_block_common import CrdtId, LwwValue, UnexpectedBlockError
 from .reader.reader import TaggedBlockReader, MainBlockInfo
 from .writer.writer import TaggedBlockWriter
@@ -24,15 +32,48 @@ from .scene_tree import SceneTree
 from . import scene_items as si
 
 
+BlockReader = tp.Callable[[TaggedBlockReader], "Block"]
+
+# Readers and classes for each main block type, filled in as `Block`
+# subclasses are defined and by `register_block_reader`.
+_BLOCK_READERS: dict[int, BlockReader] = {}
+_BLOCK_CLASSES: dict[int, tp.Type[Block]] = {}
+
+
+def register_block_reader(block_type: int, reader: BlockReader):
+    """Use `reader` to parse main blocks of type `block_type`.
+
+    `reader` is called with the `TaggedBlockReader` positioned at the start of
+    the block content and returns a `Block`. Exceptions raised by it turn the
+    block into an `UnreadableBlock`, like for the built-in blocks. Registering
+    a type again replaces the previous reader.
+
+    `Block` subclasses with their own `BLOCK_TYPE` are registered
+    automatically, using their `from_stream`.
+
+    """
+    _BLOCK_READERS[block_type] = reader
+
+
 class Block(ABC):
     BLOCK_TYPE: tp.ClassVar
 
     # Store any unrecognised data we can't understand
     extra_data: bytes = b""
 
+    # Original bytes of the block, header included, when read with
+    # `keep_raw=True`. `write_blocks` copies these instead of re-encoding.
+    raw_data: tp.Optional[bytes] = None
+
     def __init__(self, *, extra_data: bytes = b""):
         self.extra_data = extra_data
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "BLOCK_TYPE" in cls.__dict__:
+            _BLOCK_CLASSES[cls.BLOCK_TYPE] = cls
+            register_block_reader(cls.BLOCK_TYPE, cls.from_stream)
+
     def version_info(self, writer: TaggedBlockWriter) -> tuple[int, int]:
         """Return (min_version, current_version) to use when writing."""
         return (1, 1)
@@ -49,13 +90,20 @@ class Block(ABC):
 
     @classmethod
     def lookup(cls, block_type: int) -> tp.Optional[tp.Type[Block]]:
-        if getattr(cls, "BLOCK_TYPE", None) == block_type:
-            return cls
-        for subclass in cls.__subclasses__():
-            if match := subclass.lookup(block_type):
-                return match
+        """Return the subclass of `cls` handling `block_type`, if any."""
+        match = _BLOCK_CLASSES.get(block_type)
+        if match is not None and issubclass(match, cls):
+            return match
         return None
 
+    def mark_dirty(self):
+        """Drop the original bytes, so the block is re-encoded when written.
+
+        Call this after changing a block that was read with `keep_raw=True`.
+
+        """
+        self.raw_data = None
+
     def write(self, writer: TaggedBlockWriter):
         """Write the block header and content to the stream."""
         min_version, current_version = self.version_info(writer)
@@ -362,6 +410,119 @@ def point_from_stream(stream: TaggedBlockReader, version: int = 2) -> si.Point:
     return si.Point(x, y, speed, direction, width, pressure)
 
 
+_POINT_STRUCTS = {
+    1: struct.Struct("<ffffff"),
+    2: struct.Struct("<ffHHBB"),
+}
+
+
+def points_from_bytes(data: bytes, version: int = 2) -> si.PointStore:
+    """Decode a whole run of serialized points into a `PointStore`.
+
+    This gives the same values as calling `point_from_stream` once per point,
+    but unpacks the buffer in a single pass.
+
+    """
+    if version not in (1, 2):
+        raise ValueError("Unknown version %s" % version)
+    if version == 1:
+        store = si.PointStore.empty(si.PointStore.TYPECODES_V1)
+    else:
+        store = si.PointStore.empty(si.PointStore.TYPECODES_V2)
+    if not data:
+        return store
+
+    columns = list(zip(*_POINT_STRUCTS[version].iter_unpack(data)))
+    if version == 1:
+        x, y, speed, direction, width, pressure = columns
+        # calculation based on ddvk's reader, see `point_from_stream`
+        speed = [v * 4 for v in speed]
+        direction = [255 * v / (math.pi * 2) for v in direction]
+        width = [int(round(v * 4)) for v in width]
+        pressure = [v * 255 for v in pressure]
+    else:
+        x, y, speed, width, direction, pressure = columns
+    for column, values in zip(store.columns(), (x, y, speed, direction, width, pressure)):
+        column.extend(values)
+    return store
+
+
+# numpy layouts of `_POINT_STRUCTS`, for packing columns in one go
+if np is not None:
+    _POINT_DTYPES = {
+        1: np.dtype([
+            ("x", "<f4"), ("y", "<f4"), ("speed", "<f4"),
+            ("direction", "<f4"), ("width", "<f4"), ("pressure", "<f4"),
+        ]),
+        2: np.dtype([
+            ("x", "<f4"), ("y", "<f4"), ("speed", "<u2"),
+            ("width", "<u2"), ("direction", "u1"), ("pressure", "u1"),
+        ]),
+    }
+
+
+def _points_to_bytes_numpy(columns: tuple[array, ...], version: int) -> bytes:
+    x, y, speed, direction, width, pressure = (np.asarray(column) for column in columns)
+    if version == 1:
+        speed = speed / 4
+        direction = direction * (2 * math.pi) / 255
+        width = width / 4
+        pressure = pressure / 255
+    packed = np.empty(len(x), _POINT_DTYPES[version])
+    packed["x"] = x
+    packed["y"] = y
+    packed["speed"] = speed
+    packed["direction"] = direction
+    packed["width"] = width
+    packed["pressure"] = pressure
+    return packed.tobytes()
+
+
+def points_to_bytes(
+        points: tp.Union[tp.Sequence[si.Point], si.PointStore], version: int = 2
+) -> bytes:
+    """Encode a run of points, the reverse of `points_from_bytes`.
+
+    This gives the same bytes as calling `point_to_stream` once per point. A
+    `PointStore` is packed straight from its columns: with numpy into a single
+    preallocated buffer, when the column types guarantee the values fit.
+
+    """
+    if version not in (1, 2):
+        raise ValueError("Unknown version %s" % version)
+    if not points:
+        return b""
+
+    if isinstance(points, si.PointStore):
+        columns = points.columns()
+        if np is not None and (
+                version == 1
+                or tuple(column.typecode for column in columns) == si.PointStore.TYPECODES_V2
+        ):
+            return _points_to_bytes_numpy(columns, version)
+    else:
+        columns = (
+            [point.x for point in points],
+            [point.y for point in points],
+            [point.speed for point in points],
+            [point.direction for point in points],
+            [point.width for point in points],
+            [point.pressure for point in points],
+        )
+
+    x, y, speed, direction, width, pressure = columns
+    if version == 1:
+        # calculation based on ddvk's reader, see `point_to_stream`
+        speed = [v / 4 for v in speed]
+        direction = [v * (2 * math.pi) / 255 for v in direction]
+        width = [v / 4 for v in width]
+        pressure = [v / 255 for v in pressure]
+        values = (x, y, speed, direction, width, pressure)
+    else:
+        values = (x, y, speed, width, direction, pressure)
+    return b"".join(map(_POINT_STRUCTS[version].pack, *values))
+
+
 def point_serialized_size(version: int = 2) -> int:
     if version == 1:
         return 0x18
@@ -405,8 +566,7 @@ def line_from_stream(stream: TaggedBlockReader, version: int = 2) -> si.Line:
                 "Point data size mismatch: %d is not multiple of point_size"
                 % data_length
             )
-        num_points = data_length // point_size
-        points = [point_from_stream(stream, version=version) for _ in range(num_points)]
+        points = points_from_bytes(stream.data.read_bytes(data_length), version)
 
     # XXX unused
     timestamp = stream.read_id(6)
@@ -425,8 +585,7 @@ def line_to_stream(line: si.Line, writer: TaggedBlockWriter, version: int = 2):
     writer.write_double(3, line.thickness_scale)
     writer.write_float(4, line.starting_length)
     with writer.write_subblock(5):
-        for point in line.points:
-            point_to_stream(point, writer, version)
+        writer.data.write_bytes(points_to_bytes(line.points, version))
 
     # XXX didn't save
     timestamp = CrdtId(0, 1)
@@ -452,20 +611,15 @@ class SceneItemBlock(Block):
 
         assert stream.current_block
         block_type = stream.current_block.block_type
-        if block_type == SceneGlyphItemBlock.BLOCK_TYPE:
-            subclass = SceneGlyphItemBlock
-        elif block_type == SceneGroupItemBlock.BLOCK_TYPE:
-            subclass = SceneGroupItemBlock
-        elif block_type == SceneLineItemBlock.BLOCK_TYPE:
-            subclass = SceneLineItemBlock
-        elif block_type == SceneTextItemBlock.BLOCK_TYPE:
-            subclass = SceneTextItemBlock
-        elif block_type == SceneTombstoneItemBlock.BLOCK_TYPE:
-            subclass = SceneTombstoneItemBlock
+        if "BLOCK_TYPE" in cls.__dict__:
+            # Called through the block registry, which already dispatched
+            subclass = cls
         else:
-            raise ValueError(
-                "unknown scene type %d in %s" % (block_type, stream.current_block)
-            )
+            subclass = SceneItemBlock.lookup(block_type)
+            if subclass is None:
+                raise ValueError(
+                    "unknown scene type %d in %s" % (block_type, stream.current_block)
+                )
 
         parent_id = stream.read_id(1)
         item_id = stream.read_id(2)
@@ -800,7 +954,34 @@ class RootTextBlock(Block):
 ## Functions to read and write streams of blocks
 
 
-def _read_blocks(stream: TaggedBlockReader) -> Iterator[Block]:
+def _read_block(stream: TaggedBlockReader, block_info: MainBlockInfo) -> Block:
+    """Parse the content of the block `stream` is positioned in."""
+    reader = _BLOCK_READERS.get(block_info.block_type)
+    if reader is not None:
+        try:
+            return reader(stream)
+        except Exception as e:
+            stream.data.seek(block_info.offset)
+            data = stream.data.read_bytes(block_info.size)
+            return UnreadableBlock(str(e), data, block_info)
+    else:
+        msg = (
+            f"Unknown block type {block_info.block_type}. "
+            f"Skipping {block_info.size} bytes."
+        )
+        data = stream.data.read_bytes(block_info.size)
+        return UnreadableBlock(msg, data, block_info)
+
+
+def _keep_raw_data(stream: TaggedBlockReader, block: Block, block_info: MainBlockInfo):
+    """Store the original bytes of the block that was just read on `block`."""
+    start = block_info.offset - MAIN_BLOCK_HEADER_SIZE
+    end = block_info.offset + block_info.size
+    stream.data.seek(start)
+    block.raw_data = stream.data.read_bytes(end - start)
+
+
+def _read_blocks(stream: TaggedBlockReader, keep_raw: bool = False) -> Iterator[Block]:
     """
     Parse blocks from reMarkable v6 file.
     """
@@ -810,32 +991,107 @@ def _read_blocks(stream: TaggedBlockReader) -> Iterator[Block]:
                 # no more blocks
                 return
 
-            block_type = Block.lookup(block_info.block_type)
-            if block_type:
-                try:
-                    yield block_type.from_stream(stream)
-                except Exception as e:
-                    stream.data.data.seek(block_info.offset)
-                    data = stream.data.read_bytes(block_info.size)
-                    yield UnreadableBlock(str(e), data, block_info)
-            else:
-                msg = (
-                    f"Unknown block type {block_info.block_type}. "
-                    f"Skipping {block_info.size} bytes."
-                )
-                data = stream.data.read_bytes(block_info.size)
-                yield UnreadableBlock(msg, data, block_info)
+            block = _read_block(stream, block_info)
+
+        if keep_raw:
+            _keep_raw_data(stream, block, block_info)
+        yield block
 
 
-def read_blocks(data: tp.BinaryIO) -> Iterator[Block]:
+def read_blocks(data: tp.Union[tp.BinaryIO, bytes], keep_raw: bool = False) -> Iterator[Block]:
     """
     Parse reMarkable file and return iterator of document items.
 
-    :param data: reMarkable file data.
+    :param data: reMarkable file data, as a binary stream or in-memory bytes.
+    :param keep_raw: keep the original bytes of each block in `raw_data`, so
+        that `write_blocks` writes unchanged blocks back verbatim.
     """
     stream = TaggedBlockReader(data)
     stream.read_header()
-    yield from _read_blocks(stream)
+    yield from _read_blocks(stream, keep_raw)
+
+
+# Size of a main block header: length, unknown byte, versions and type
+MAIN_BLOCK_HEADER_SIZE = 8
+
+
+class BlockIndex:
+    """Lazy index of the blocks in a reMarkable v6 file.
+
+    Building the index walks the file once, reading only the main block
+    headers and recording their `MainBlockInfo` (offset, size, type and
+    versions). A block is only parsed when it is accessed, so callers that
+    only need e.g. the root text, the layers or the `SceneInfo` don't pay for
+    decoding the points of every line.
+
+        index = BlockIndex(data)
+        for block in index.blocks_of_type(RootTextBlock):
+            ...
+
+    With `keep_raw`, parsed blocks keep their original bytes like with
+    `read_blocks`. The index keeps reading from `data`, so it should not be
+    shared between threads.
+
+    """
+
+    def __init__(self, data: tp.Union[tp.BinaryIO, bytes], keep_raw: bool = False):
+        self._stream = TaggedBlockReader(data)
+        self._keep_raw = keep_raw
+        self._stream.read_header()
+        self._blocks: dict[int, Block] = {}
+        self.infos: list[MainBlockInfo] = []
+
+        stream = self._stream
+        while True:
+            with stream.read_block() as block_info:
+                if block_info is None:
+                    break
+                # Skip the content, so there is nothing left for the size check
+                stream.data.seek(block_info.offset + block_info.size)
+                self.infos.append(block_info)
+
+    def __len__(self) -> int:
+        return len(self.infos)
+
+    def __getitem__(self, index: int) -> Block:
+        """Return the block at `index`, parsing it on first access."""
+        if index < 0:
+            index += len(self.infos)
+        if (block := self._blocks.get(index)) is not None:
+            return block
+
+        info = self.infos[index]
+        stream = self._stream
+        stream.data.seek(info.offset - MAIN_BLOCK_HEADER_SIZE)
+        with stream.read_block() as block_info:
+            block = _read_block(stream, block_info)
+        if self._keep_raw:
+            _keep_raw_data(stream, block, block_info)
+        self._blocks[index] = block
+        return block
+
+    def __iter__(self) -> Iterator[Block]:
+        for index in range(len(self.infos)):
+            yield self[index]
+
+    def indices_of_type(self, *block_types: tp.Type[Block]) -> list[int]:
+        """Return the indices of blocks of any of the given classes.
+
+        A class without a `BLOCK_TYPE` of its own, like `SceneItemBlock`,
+        matches the block types of its registered subclasses.
+
+        """
+        wanted = {
+            block_type
+            for block_type, block_class in _BLOCK_CLASSES.items()
+            if issubclass(block_class, block_types)
+        }
+        return [index for index, info in enumerate(self.infos) if info.block_type in wanted]
+
+    def blocks_of_type(self, *block_types: tp.Type[Block]) -> Iterator[Block]:
+        """Parse and yield only the blocks of any of the given classes."""
+        for index in self.indices_of_type(*block_types):
+            yield self[index]
 
 
 def write_blocks(
@@ -843,64 +1099,119 @@ def write_blocks(
 ):
     """
     Write blocks to file.
+
+    Blocks read with `keep_raw=True` are copied verbatim, unless they have
+    been marked dirty or a `version` to write is given in `options`.
     """
+    passthrough = True
     if options is not None and "version" in options:
         options["version"] = Version(options["version"])
+        passthrough = False
     stream = TaggedBlockWriter(data, options=options)
     stream.write_header()
     for block in blocks:
-        block.write(stream)
+        if passthrough and block.raw_data is not None:
+            stream.data.write_bytes(block.raw_data)
+        else:
+            block.write(stream)
+
+
+def _add_block_to_tree(tree: SceneTree, b: Block):
+    """Add the contents of block `b` to `tree`."""
+    if isinstance(b, SceneTreeBlock):
+        # XXX check node_id and is_update
+        # pending_tree_nodes[b.tree_id] = b
+        tree.add_node(b.tree_id, parent_id=b.parent_id)
+    elif isinstance(b, TreeNodeBlock):
+        # Expect this node to already exist; adding information
+        # if b.node_id not in pending_tree_nodes:
+        if b.group.node_id not in tree:
+            raise ValueError(
+                "Node does not exist for TreeNodeBlock: %s" % b.group.node_id
+            )
+        node = tree[b.group.node_id]
+        node.label = b.group.label
+        node.visible = b.group.visible
+        node.anchor_id = b.group.anchor_id
+        node.anchor_type = b.group.anchor_type
+        node.anchor_threshold = b.group.anchor_threshold
+        node.anchor_origin_x = b.group.anchor_origin_x
+    elif isinstance(b, SceneGroupItemBlock):
+        # Add this entry to children of parent_id
+        node_id = b.item.value
+        if node_id not in tree:
+            return
+            raise ValueError(
+                "Node does not exist for SceneGroupItemBlock: %s" % node_id
+            )
+        item = replace(b.item, value=tree[node_id])
+        tree.add_item(item, b.parent_id)
+    elif isinstance(b, (SceneLineItemBlock, SceneGlyphItemBlock)):
+        # Add this entry to children of parent_id
+        tree.add_item(b.item, b.parent_id)
+    elif isinstance(b, RootTextBlock):
+        tree.root_text = b.value
 
 
 def build_tree(tree: SceneTree, blocks: Iterable[Block]):
     """Read `blocks` and add contents to `tree`."""
     for b in blocks:
-        if isinstance(b, SceneTreeBlock):
-            # XXX check node_id and is_update
-            # pending_tree_nodes[b.tree_id] = b
-            tree.add_node(b.tree_id, parent_id=b.parent_id)
-        elif isinstance(b, TreeNodeBlock):
-            # Expect this node to already exist; adding information
-            # if b.node_id not in pending_tree_nodes:
-            if b.group.node_id not in tree:
-                raise ValueError(
-                    "Node does not exist for TreeNodeBlock: %s" % b.group.node_id
-                )
-            node = tree[b.group.node_id]
-            node.label = b.group.label
-            node.visible = b.group.visible
-            node.anchor_id = b.group.anchor_id
-            node.anchor_type = b.group.anchor_type
-            node.anchor_threshold = b.group.anchor_threshold
-            node.anchor_origin_x = b.group.anchor_origin_x
-        elif isinstance(b, SceneGroupItemBlock):
-            # Add this entry to children of parent_id
-            node_id = b.item.value
-            if node_id not in tree:
-                continue
-                raise ValueError(
-                    "Node does not exist for SceneGroupItemBlock: %s" % node_id
-                )
-            item = replace(b.item, value=tree[node_id])
-            tree.add_item(item, b.parent_id)
-        elif isinstance(b, (SceneLineItemBlock, SceneGlyphItemBlock)):
-            # Add this entry to children of parent_id
-            tree.add_item(b.item, b.parent_id)
-        elif isinstance(b, RootTextBlock):
-            tree.root_text = b.value
+        _add_block_to_tree(tree, b)
 
 
-def read_tree(data: tp.BinaryIO) -> SceneTree:
+def iter_build_tree(
+        tree: SceneTree, blocks: Iterable[Block], every_blocks: int = 1000, every_ms: float = 200
+) -> Iterator[SceneTree]:
+    """Read `blocks` into `tree` incrementally, yielding it as it grows.
+
+    `tree` is yielded after every `every_blocks` blocks or `every_ms`
+    milliseconds of parsing, whichever comes first, and once more when all
+    blocks have been added. Since `blocks` is consumed lazily (e.g. straight
+    from `read_blocks`), each yielded tree is a renderable partial scene.
+
+    The same `tree` object is yielded every time; it is only consistent until
+    the generator is resumed.
+
+    """
+    pending = 0
+    yielded = False
+    last_yield = time.perf_counter()
+    for b in blocks:
+        _add_block_to_tree(tree, b)
+        pending += 1
+        if pending >= every_blocks or (time.perf_counter() - last_yield) * 1000 >= every_ms:
+            yield tree
+            pending = 0
+            yielded = True
+            last_yield = time.perf_counter()
+    if pending or not yielded:
+        yield tree
+
+
+def read_tree(data: tp.Union[tp.BinaryIO, bytes]) -> SceneTree:
     """
     Parse reMarkable file and return `SceneTree`.
 
-    :param data: reMarkable file data.
+    :param data: reMarkable file data, as a binary stream or in-memory bytes.
     """
     tree = SceneTree()
     build_tree(tree, read_blocks(data))
     return tree
 
 
+def iter_read_tree(
+        data: tp.Union[tp.BinaryIO, bytes], every_blocks: int = 1000, every_ms: float = 200
+) -> Iterator[SceneTree]:
+    """
+    Parse reMarkable file, yielding the partial `SceneTree` as it is built.
+
+    See `iter_build_tree` for when snapshots are published.
+
+    :param data: reMarkable file data, as a binary stream or in-memory bytes.
+    """
+    yield from iter_build_tree(SceneTree(), read_blocks(data), every_blocks, every_ms)
+
+
 def simple_text_document(text: str, author_uuid=None) -> Iterator[Block]:
     """Return the basic blocks to represent `text` as plain text.
 
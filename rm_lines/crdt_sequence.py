@@ -7,7 +7,7 @@ from typing import Iterable
 from collections import defaultdict
 from dataclasses import dataclass
 
-from .tagged_block_common import CrdtId
+from .tagged_block_common import CrdtId, add_slots
 
 # If the type constraint is for a CrdtSequenceItem[Superclass], then a
 # CrdtSequenceItem[Subclass] would do, so it is covariant.
@@ -15,6 +15,7 @@ from .tagged_block_common import CrdtId
 _T = tp.TypeVar("_T", covariant=True)
 
 
+@add_slots
 @dataclass
 class CrdtSequenceItem(tp.Generic[_T]):
     item_id: CrdtId
@@ -36,12 +37,18 @@ class CrdtSequence(tp.Generic[_Ti]):
 
     Iterating through the `CrdtSequence` yields IDs following this order.
 
+    The sorted ids and values are materialised on first access and kept until
+    the sequence is modified with `add`.
+
     """
 
     def __init__(self, items=None):
         if items is None:
             items = []
         self._items = {item.item_id: item for item in items}
+        # Sorted ids and their values, computed on first access and reset by `add`
+        self._order: tp.Optional[list[CrdtId]] = None
+        self._values: tp.Optional[list[_Ti]] = None
 
     def __eq__(self, other):
         if isinstance(other, CrdtSequence):
@@ -55,21 +62,42 @@ class CrdtSequence(tp.Generic[_Ti]):
 
     ## Access values, in order
 
+    def _ordered(self) -> tuple[list[CrdtId], list[_Ti]]:
+        """Return the sorted ids and values, sorting only after changes."""
+        if self._order is None:
+            items = self._items
+            order = list(toposort_items(items.values()))
+            self._values = [items[item_id].value for item_id in order]
+            self._order = order
+        return self._order, self._values
+
     def __iter__(self) -> tp.Iterator[CrdtId]:
         """Return ids in order"""
-        yield from toposort_items(self._items.values())
+        return iter(self._ordered()[0])
+
+    def __len__(self) -> int:
+        """Return the number of items in order, without those on a cycle."""
+        return len(self._ordered()[0])
 
     def keys(self) -> list[CrdtId]:
         """Return CrdtIds in order."""
-        return list(self)
+        return list(self._ordered()[0])
 
     def values(self) -> list[_Ti]:
         """Return list of sorted values."""
-        return [self[item_id] for item_id in self]
+        return list(self._ordered()[1])
+
+    def ordered_values(self) -> tp.Iterator[_Ti]:
+        """Iterate through sorted values without copying or id lookups."""
+        return iter(self._ordered()[1])
 
     def items(self) -> Iterable[tuple[CrdtId, _Ti]]:
         """Return list of sorted key, value pairs."""
-        return [(item_id, self[item_id]) for item_id in self]
+        return list(zip(*self._ordered()))
+
+    def value_at(self, index: int) -> _Ti:
+        """Return the value at position `index` in the sorted order."""
+        return self._ordered()[1][index]
 
     def __getitem__(self, key: CrdtId) -> _Ti:
         """Return item with key"""
@@ -87,6 +115,8 @@ class CrdtSequence(tp.Generic[_Ti]):
         if item.item_id in self._items:
             raise ValueError("Already have item %s" % item.item_id)
         self._items[item.item_id] = item
+        self._order = None
+        self._values = None
 
 
 END_MARKER = CrdtId(0, 0)
@@ -120,26 +150,47 @@ def toposort_items(items: Iterable[CrdtSequenceItem]) -> Iterable[CrdtId]:
         data[item.item_id].add(left_id)
         data[right_id].add(item.item_id)
 
+    # Kahn's algorithm. Each node is assigned the round in which it would
+    # become free of dependencies if they were all removed round by round,
+    # i.e. one more than its latest dependency. Items are ordered by round,
+    # then by id, so the order is stable regardless of insertion order.
+    dependents = defaultdict(list)
+    remaining = {}
+    for node, deps in data.items():
+        remaining[node] = len(deps)
+        for dep in deps:
+            dependents[dep].append(node)
     # fill in sources not explicitly included
-    sources_not_in_data = {dep for deps in data.values() for dep in deps} - {
-        k for k in data.keys()
-    }
-    data.update({k: set() for k in sources_not_in_data})
-
-    while True:
-        next_items = {item for item, deps in data.items() if not deps}
-        if not next_items:
-            # Skips over the assert below, in most cases this is not a problem
+    for dep in dependents:
+        if dep not in remaining:
+            remaining[dep] = 0
+
+    ready = [node for node, count in remaining.items() if count == 0]
+    level = dict.fromkeys(ready, 0)
+    i = 0
+    while i < len(ready):
+        node = ready[i]
+        i += 1
+        next_level = level[node] + 1
+        for dependent in dependents.get(node, ()):
+            if level.get(dependent, 0) < next_level:
+                level[dependent] = next_level
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    rounds = defaultdict(list)
+    for node in ready:
+        rounds[level[node]].append(node)
+
+    done = 0
+    for round_index in range(len(rounds)):
+        next_items = rounds[round_index]
+        if next_items == ["__end"]:
+            # Anything left over must be waiting on a cycle
+            if done + 1 != len(remaining):
+                raise ValueError("cyclic dependency")
             return
-        if next_items == {"__end"}:
-            break
-        assert next_items
+        # Nodes stuck in a cycle never become free; those are skipped
         yield from sorted(k for k in next_items if k in item_dict)
-        data = {
-            item: (deps - next_items)
-            for item, deps in data.items()
-            if item not in next_items
-        }
-
-    if data != {"__end": set()}:
-        raise ValueError("cyclic dependency")
+        done += len(next_items)
@@ -67,6 +67,21 @@ class DocumentSizeTracker(ABC):
             self.track_top = y
         return y
 
+    def track_bbox(self, min_x, min_y, max_x, max_y):
+        """Track a box, such as the bounding box of a stroke.
+
+        The lower bounds are tracked first, so the tracked area ends up
+        covering the whole box. Moving the left or top edge also moves the
+        opposite edge, so this can track a larger area than the points of
+        the stroke would when they reach past the right or bottom edge
+        before reaching past the left or top one.
+
+        """
+        self.x(min_x)
+        self.x(max_x)
+        self.y(min_y)
+        self.y(max_y)
+
     @property
     def format_kwargs(self):
         return {
@@ -0,0 +1,180 @@
+"""Level of detail: simplify strokes for drawing at small scales.
+
+When a page is drawn much smaller than its own coordinates, for a thumbnail
+or a zoomed out view, most points of a stroke end up within a fraction of a
+pixel of each other. `simplify` drops the points that are within `tolerance`
+of the simplified line: a radial distance pass first, followed by
+Ramer-Douglas-Peucker on what is left.
+
+Scales are grouped in power-of-two zoom buckets, each simplified for the
+largest scale in the bucket. This way a simplification can be cached and
+reused across a range of zooms. At `LOD_MAX_SCALE` and above, strokes are
+drawn exactly.
+"""
+import math
+import typing as tp
+
+from .writing_tools import Pen
+from ..scene_items import Line, PointStore
+
+# Strokes are only simplified when drawn at less than this many pixels per unit
+LOD_MAX_SCALE = 0.5
+
+# How far the simplified stroke may stray from the original, in pixels
+LOD_TOLERANCE = 0.5
+
+# Segments are merged when their widths round to the same step in pixels,
+# and their opacities to the same step
+LOD_WIDTH_STEP = 0.25
+LOD_OPACITY_STEPS = 16
+
+# Most points Ramer-Douglas-Peucker looks at in one go, see `simplify`
+RDP_WINDOW = 256
+
+# Pen widths are divided by this when drawn, see `svg.draw_stroke`
+WIDTH_DIVISOR = 5
+
+
+def zoom_bucket(scale: float) -> tp.Optional[int]:
+    """Return the zoom bucket for drawing at `scale` pixels per unit, or None to draw exactly."""
+    if scale >= LOD_MAX_SCALE or scale <= 0:
+        return None
+    return math.floor(math.log2(scale))
+
+
+def bucket_tolerance(bucket: int) -> float:
+    """Return the tolerance in units for a zoom bucket."""
+    return LOD_TOLERANCE / 2 ** (bucket + 1)
+
+
+def simplify(xs, ys, tolerance: float, first: int = 0, stop: int = None) -> list[int]:
+    """Return the indices of the points in [first, stop) to keep.
+
+    The first and last points are always kept.
+
+    """
+    if stop is None:
+        stop = len(xs)
+    if stop - first <= 2:
+        return list(range(first, stop))
+    squared_tolerance = tolerance * tolerance
+
+    # Radial distance: drop points close to the last kept point
+    kept = [first]
+    last_x = xs[first]
+    last_y = ys[first]
+    for index in range(first + 1, stop - 1):
+        x = xs[index]
+        y = ys[index]
+        dx = x - last_x
+        dy = y - last_y
+        if dx * dx + dy * dy > squared_tolerance:
+            kept.append(index)
+            last_x = x
+            last_y = y
+    kept.append(stop - 1)
+    if len(kept) <= 2:
+        return kept
+
+    # Ramer-Douglas-Peucker, with a stack instead of recursion. Long strokes
+    # are split into windows, whose ends are kept, to bound the work when
+    # the splits are uneven.
+    keep = [False] * len(kept)
+    stack = []
+    for start in range(0, len(kept) - 1, RDP_WINDOW):
+        end = min(start + RDP_WINDOW, len(kept) - 1)
+        keep[start] = keep[end] = True
+        stack.append((start, end))
+    while stack:
+        start, end = stack.pop()
+        ax = xs[kept[start]]
+        ay = ys[kept[start]]
+        bx = xs[kept[end]]
+        by = ys[kept[end]]
+        dx = bx - ax
+        dy = by - ay
+        length = dx * dx + dy * dy
+        max_distance = squared_tolerance
+        farthest = None
+        for position in range(start + 1, end):
+            index = kept[position]
+            px = xs[index] - ax
+            py = ys[index] - ay
+            if length:
+                # Squared distance to the segment
+                t = (px * dx + py * dy) / length
+                if t > 1:
+                    px -= dx
+                    py -= dy
+                elif t > 0:
+                    px -= t * dx
+                    py -= t * dy
+            distance = px * px + py * py
+            if distance > max_distance:
+                max_distance = distance
+                farthest = position
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return [index for index, flag in zip(kept, keep) if flag]
+
+
+def stroke_runs(item: Line, pen: Pen, scale: float = None, key=None) -> list[tuple[tuple, tp.Sequence[int]]]:
+    """Return the runs of `pen.segment_runs` with the indices of the points to draw.
+
+    At full zoom, or without a `scale`, segments are merged by `key` and
+    every point is kept. Zoomed out, segments are merged when their styles
+    look the same at the scale, and each run is simplified on its own so that
+    the styles still apply to the same parts of the stroke.
+
+    """
+    points = item.points
+    count = len(points)
+    bucket = None if scale is None else zoom_bucket(scale)
+    if bucket is None:
+        return [(style, range(first, min(stop, count))) for style, first, stop in pen.segment_runs(points, key)]
+
+    if isinstance(points, PointStore):
+        xs, ys = points.x, points.y
+    else:
+        xs = [point.x for point in points]
+        ys = [point.y for point in points]
+    # The largest scale in the bucket
+    bucket_scale = 2 ** (bucket + 1)
+    width_step = LOD_WIDTH_STEP * WIDTH_DIVISOR / bucket_scale
+    tolerance = bucket_tolerance(bucket)
+
+    def coarse_key(style):
+        color, width, opacity = style
+        return color, round(width / width_step), round(opacity * LOD_OPACITY_STEPS)
+
+    return [(style, simplify(xs, ys, tolerance, first, min(stop, count)))
+            for style, first, stop in pen.segment_runs(points, coarse_key)]
+
+
+class LodCache:
+    """Simplified runs of strokes, kept per zoom bucket.
+
+    Entries are checked against the points of the line, like `Line.bbox`, so
+    lines that are extended after being drawn are simplified again.
+
+    """
+
+    def __init__(self):
+        self._runs: dict[tuple[int, tp.Optional[int]], tuple] = {}
+
+    def stroke_runs(self, item: Line, pen: Pen, scale: float) -> list[tuple[tuple, tp.Sequence[int]]]:
+        bucket = zoom_bucket(scale)
+        if bucket is None:
+            return stroke_runs(item, pen)
+        cache_key = (id(item), bucket)
+        cached = self._runs.get(cache_key)
+        if cached is not None and cached[0] is item and cached[1] is item.points and cached[2] == len(item.points):
+            return cached[3]
+        runs = stroke_runs(item, pen, scale)
+        self._runs[cache_key] = (item, item.points, len(item.points), runs)
+        return runs
+
+    def clear(self):
+        self._runs.clear()
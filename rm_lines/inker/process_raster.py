@@ -0,0 +1,51 @@
+"""Rasterise .rm files in another process.
+
+Parsing and drawing are pure Python, so on a thread they compete for the
+GIL with whatever else the program is doing. `render_rm` is meant to be run
+in a process pool instead: it takes the raw bytes of a page and writes the
+first frame of it as RGBA rows into a shared memory block allocated by the
+caller, so that the pixels are not pickled back.
+
+    shm = shared_memory.SharedMemory(create=True, size=rgba_size(size))
+    track_xy = pool.submit(render_rm, data, 'notebook', size, shm.name).result()
+    surface = pygame.image.frombuffer(shm.buf[:rgba_size(size)], size, 'RGBA')
+
+pygame is needed, see `raster`.
+"""
+from multiprocessing import shared_memory
+
+from .document_size_tracker import DocumentSizeTracker, NotebookSizeTracker, PDFSizeTracker
+from .raster import pygame, tree_to_surface
+from .svg import track_tree
+from ..blocks import read_tree
+
+# The size trackers `render_rm` can use, by name
+SIZE_TRACKERS = {
+    'notebook': NotebookSizeTracker,
+    'pdf': PDFSizeTracker,
+}
+
+
+def rgba_size(size: tuple[int, int]) -> int:
+    """Return the number of bytes of an RGBA image of `size`."""
+    return size[0] * size[1] * 4
+
+
+def render_rm(data: bytes, tracker: str, size: tuple[int, int], shm_name: str) -> DocumentSizeTracker:
+    """Draw the first frame of a page to `size` in the shared memory block `shm_name`.
+
+    :param data: The .rm file.
+    :param tracker: The name of the size tracker in `SIZE_TRACKERS`.
+    :return: The size tracker, having tracked the page.
+    """
+    track_xy = SIZE_TRACKERS[tracker]()
+    tree = read_tree(data)
+    track_tree(tree, track_xy)
+    view = (-track_xy.offset_x, -track_xy.offset_y, track_xy.frame_width, track_xy.frame_height)
+    surface = tree_to_surface(tree, view, size)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        shm.buf[:rgba_size(size)] = pygame.image.tostring(surface, 'RGBA')
+    finally:
+        shm.close()
+    return track_xy
@@ -0,0 +1,259 @@
+"""Rasterise a scene tree straight to a pygame surface.
+
+This is an alternative to `tree_to_svg` followed by an SVG renderer: strokes
+are drawn with the same `Pen` rules for width, color and opacity, without
+generating or parsing any SVG. Anti-aliasing comes from drawing at
+`SUPERSAMPLE` times the requested size and scaling down smoothly.
+
+pygame is an optional dependency of rm_lines and only needed to use this.
+"""
+import math
+from functools import lru_cache
+from typing import Optional
+
+from .document_size_tracker import SCREEN_WIDTH
+from .lod import LodCache, stroke_runs
+from .svg import PAGE_ANCHORS, group_anchor, layout_text
+from .writing_tools import Pen
+from ..scene_items import Group, Line, PointStore
+from ..scene_tree import SceneTree
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+# Draw at this many times the final size, for anti-aliasing
+SUPERSAMPLE = 2
+
+# Stroke width divisor, as in `svg.draw_stroke`
+K = 5
+
+# Grid cell size of `SceneIndex`, and how far strokes may reach beyond
+# their points, in scene units
+CELL_SIZE = 256
+STROKE_MARGIN = 50
+
+# Font size in points and boldness per paragraph class, as in the SVG style
+TEXT_FONTS = {
+    'heading': (14, False),
+    'bold': (8, True),
+}
+DEFAULT_TEXT_FONT = (7, False)
+POINT_TO_UNITS = 4 / 3
+TEXT_COLOR = (0, 0, 0, 255)
+
+
+def parse_color(color: str) -> tuple[int, int, int]:
+    """Parse the "rgb(r, g, b)" colors returned by the pens."""
+    values = color[color.index('(') + 1:color.rindex(')')]
+    return tuple(int(float(value)) for value in values.split(','))
+
+
+class SceneIndex:
+    """The strokes and text of a scene tree, for drawing parts of it.
+
+    Strokes are flattened in drawing order together with the translation of
+    their groups, and bucketed on a grid of `cell_size` units by bounding
+    box, so that `strokes_in` only looks at the strokes near a view.
+
+    """
+
+    def __init__(self, tree: SceneTree, cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        anchor_pos = dict(PAGE_ANCHORS)
+        self.text_lines = []
+        if tree.root_text is not None:
+            self.text_lines = layout_text(tree.root_text, anchor_pos)
+
+        # (line, x, y) for each stroke with points, x and y being the group translation
+        self.strokes: list[tuple[Line, float, float]] = []
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        self.point_count = 0
+        # Simplified strokes for drawing zoomed out
+        self.lod = LodCache()
+        self._add_group(tree.root, anchor_pos, 0.0, 0.0)
+
+    def _add_group(self, item: Group, anchor_pos, x: float, y: float):
+        anchor_x, anchor_y = group_anchor(item, anchor_pos)
+        x += anchor_x
+        y += anchor_y
+        for child in item.children.ordered_values():
+            if isinstance(child, Group):
+                self._add_group(child, anchor_pos, x, y)
+            elif isinstance(child, Line):
+                bbox = child.bbox()
+                if bbox is None:
+                    continue
+                index = len(self.strokes)
+                self.strokes.append((child, x, y))
+                self.point_count += len(child.points)
+                min_x, min_y, max_x, max_y = bbox
+                for cell in self._cells_of(min_x + x, min_y + y, max_x + x, max_y + y):
+                    self._cells.setdefault(cell, []).append(index)
+
+    def _cells_of(self, min_x: float, min_y: float, max_x: float, max_y: float):
+        size = self.cell_size
+        for cell_x in range(math.floor(min_x / size), math.floor(max_x / size) + 1):
+            for cell_y in range(math.floor(min_y / size), math.floor(max_y / size) + 1):
+                yield cell_x, cell_y
+
+    def strokes_in(self, min_x: float, min_y: float, max_x: float, max_y: float) -> list[tuple[Line, float, float]]:
+        """Return the strokes that may be visible in the area, in drawing order."""
+        cells = self._cells
+        if not cells:
+            return []
+        margin = STROKE_MARGIN
+        min_x -= margin
+        min_y -= margin
+        max_x += margin
+        max_y += margin
+        size = self.cell_size
+        if (max_x - min_x) * (max_y - min_y) > len(cells) * size * size:
+            # The area covers more cells than are in use
+            candidates = range(len(self.strokes))
+        else:
+            found = set()
+            for cell in self._cells_of(min_x, min_y, max_x, max_y):
+                indices = cells.get(cell)
+                if indices:
+                    found.update(indices)
+            candidates = sorted(found)
+
+        strokes = []
+        for index in candidates:
+            stroke = self.strokes[index]
+            line, x, y = stroke
+            line_min_x, line_min_y, line_max_x, line_max_y = line.bbox()
+            if (line_max_x + x >= min_x and line_min_x + x <= max_x and
+                    line_max_y + y >= min_y and line_min_y + y <= max_y):
+                strokes.append(stroke)
+        return strokes
+
+
+def tree_to_surface(tree: SceneTree, view: tuple[float, float, float, float], size: tuple[int, int],
+                    supersample: int = SUPERSAMPLE, index: Optional[SceneIndex] = None) -> 'pygame.Surface':
+    """Render the part of `tree` in `view` to a transparent surface of `size`.
+
+    `view` is `(x, y, width, height)` in the coordinates of the SVG viewBox
+    produced by `tree_to_svg`. Like SVG, the view is scaled uniformly to fit
+    and centered. Pass a `SceneIndex` of the tree to reuse it when drawing
+    several views.
+
+    """
+    if pygame is None:
+        raise ImportError("pygame is required for raster rendering")
+    if index is None:
+        index = SceneIndex(tree)
+
+    width, height = size
+    view_x, view_y, view_width, view_height = view
+    canvas = pygame.Surface((width * supersample, height * supersample), pygame.SRCALPHA)
+    scale = min(width / view_width, height / view_height) * supersample
+    origin_x = (width * supersample - view_width * scale) / 2 - view_x * scale
+    origin_y = (height * supersample - view_height * scale) / 2 - view_y * scale
+    # The page group is shifted like in `tree_to_svg`
+    origin_x += SCREEN_WIDTH / 2 * scale
+
+    # The area of the canvas in the coordinates of the scene
+    min_x = -origin_x / scale
+    min_y = -origin_y / scale
+    max_x = min_x + width * supersample / scale
+    max_y = min_y + height * supersample / scale
+
+    text_lines = [text_line for text_line in index.text_lines
+                  if min_y - STROKE_MARGIN <= text_line[1] <= max_y + STROKE_MARGIN]
+    if text_lines:
+        draw_text(canvas, text_lines, origin_x, origin_y, scale)
+    for line, x, y in index.strokes_in(min_x, min_y, max_x, max_y):
+        draw_stroke(canvas, line, origin_x + x * scale, origin_y + y * scale, scale, index.lod)
+
+    if supersample > 1:
+        canvas = pygame.transform.smoothscale(canvas, (width, height))
+    return canvas
+
+
+def draw_stroke(canvas: 'pygame.Surface', item: Line, origin_x: float, origin_y: float, scale: float,
+                lod: Optional[LodCache] = None):
+    pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale / 10)
+
+    points = item.points
+    if isinstance(points, PointStore):
+        xs, ys = points.x, points.y
+    else:
+        xs = [point.x for point in points]
+        ys = [point.y for point in points]
+
+    # The same runs of segments as `svg.draw_stroke_paths`, simplified when
+    # drawing zoomed out
+    if lod is not None:
+        runs = lod.stroke_runs(item, pen, scale)
+    else:
+        runs = stroke_runs(item, pen, scale)
+
+    round_cap = pen.stroke_linecap == 'round'
+    translucent = []
+    for (segment_color, segment_width, segment_opacity), indices in runs:
+        width = segment_width / K * scale
+        opacity = min(segment_opacity, 1)
+        if opacity <= 0 or width <= 0:
+            continue
+        coordinates = [(origin_x + xs[index] * scale, origin_y + ys[index] * scale) for index in indices]
+        rgba = (*parse_color(segment_color), round(opacity * 255))
+        if opacity < 1:
+            translucent.append((coordinates, rgba, width))
+        else:
+            draw_polyline(canvas, coordinates, rgba, width, round_cap)
+    if translucent:
+        draw_layer(canvas, translucent, round_cap)
+
+
+def draw_layer(canvas: 'pygame.Surface', runs: list[tuple[list[tuple[float, float]], tuple[int, int, int, int], float]],
+               round_cap: bool = True):
+    """Draw translucent runs of `(coordinates, rgba, width)` on one layer, blended in at once.
+
+    The alpha of each run is written to the layer as is, so overlapping
+    parts of the stroke don't darken, like a single SVG element.
+
+    """
+    pad = max(width for _, _, width in runs) / 2 + 2
+    left = int(min(x for coordinates, _, _ in runs for x, _ in coordinates) - pad)
+    top = int(min(y for coordinates, _, _ in runs for _, y in coordinates) - pad)
+    right = int(max(x for coordinates, _, _ in runs for x, _ in coordinates) + pad) + 1
+    bottom = int(max(y for coordinates, _, _ in runs for _, y in coordinates) + pad) + 1
+    layer = pygame.Surface((right - left, bottom - top), pygame.SRCALPHA)
+    for coordinates, rgba, width in runs:
+        draw_polyline(layer, [(x - left, y - top) for x, y in coordinates], rgba, width, round_cap)
+    canvas.blit(layer, (left, top))
+
+
+def draw_polyline(target: 'pygame.Surface', coordinates: list[tuple[float, float]], rgba: tuple[int, int, int, int],
+                  width: float, round_cap: bool = True):
+    """Draw a polyline of `width` pixels."""
+    line_width = max(1, round(width))
+    if len(coordinates) > 1:
+        pygame.draw.lines(target, rgba, False, coordinates, line_width)
+    if (round_cap and line_width > 2) or len(coordinates) == 1:
+        # Round caps and joins, which also fill the gaps between thick segments
+        radius = width / 2
+        for coordinate in coordinates:
+            pygame.draw.circle(target, rgba, coordinate, radius)
+
+
+@lru_cache(maxsize=32)
+def _font(size: int, bold: bool) -> 'pygame.font.Font':
+    if not pygame.font.get_init():
+        pygame.font.init()
+    font = pygame.font.Font(None, size)
+    font.set_bold(bold)
+    return font
+
+
+def draw_text(canvas: 'pygame.Surface', text_lines, origin_x: float, origin_y: float, scale: float,
+              color: Optional[tuple[int, int, int, int]] = None):
+    """Draw the lines from `layout_text`, with `y` as the baseline."""
+    for pos_x, pos_y, cls, line, _ in text_lines:
+        points, bold = TEXT_FONTS.get(cls, DEFAULT_TEXT_FONT)
+        font = _font(max(1, round(points * POINT_TO_UNITS * scale)), bold)
+        rendered = font.render(line.strip(), True, color or TEXT_COLOR)
+        canvas.blit(rendered, (origin_x + pos_x * scale, origin_y + pos_y * scale - font.get_ascent()))
@@ -3,17 +3,17 @@
 Code originally from https://github.com/lschwetlick/maxio through
 https://github.com/chemag/maxio .
 """
-import io
 from pathlib import Path
 
 from typing import Union
 
 from rm_lines.inker.document_size_tracker import DocumentSizeTracker, NotebookSizeTracker
 
+from .lod import stroke_runs
 from .writing_tools import (
     Pen,
 )
-from ..scene_items import ParagraphStyle, Group, Line, Text
+from ..scene_items import ParagraphStyle, Group, Line, PointStore, Text
 from ..scene_tree import SceneTree
 from ..tagged_block_common import CrdtId
 from ..text import TextDocument
@@ -40,6 +40,12 @@ LINE_HEIGHTS = {
     # line, but there is still something a bit odd going on here.
 }
 
+# These special anchor IDs are for the top and bottom of the page.
+PAGE_ANCHORS = {
+    CrdtId(0, 281474976710654): 270,
+    CrdtId(0, 281474976710655): 700,
+}
+
 # <html>
 # <body>
 # <div style="border: 1px solid grey; margin: 2em; float: left;">
@@ -49,58 +55,87 @@ SVG_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
 """
 
 
-class SvgWriter:
-    def __init__(self):
-        self._output = io.StringIO()
+def read_template_svg(template_path: Path) -> str:
+    lines = template_path.read_text().splitlines()
+    return "\n".join(lines[2:-1])
 
-    def write(self, text):
-        self._output.write(text)
 
-    def format(self, **kwargs):
-        return self._output.getvalue().format(**kwargs)
+def svg_header(width, height, view) -> str:
+    """Return the SVG header for an image of `width` and `height` showing `view` (x, y, width, height)."""
+    return SVG_HEADER.format(width=width, height=height, viewbox=' '.join(map(str, view)))
 
 
-def read_template_svg(template_path: Path) -> str:
-    lines = template_path.read_text().splitlines()
-    return "\n".join(lines[2:-1])
+def tree_to_svg(tree: SceneTree, output_file, track_xy: DocumentSizeTracker = None,
+                compact: bool = False, debug: bool = None, lod_scale: float = None, header: bool = True):
+    """Convert Tree to SVG.
+
+    The SVG header depends on the size of the drawing, so the text positions,
+    group anchors and stroke bounding boxes are first fed to `track_xy` in the
+    order they are drawn, and the SVG is then written to `output_file` in a
+    single pass.
 
+    With `compact`, strokes are drawn as one `<path>` per run of segments with
+    the same style instead of a `<polyline>` per segment. `debug` adds
+    comments identifying the items, and defaults to on unless `compact`.
 
-def tree_to_svg(tree: SceneTree, output_file, track_xy: DocumentSizeTracker = None):
-    """Convert Tree to SVG."""
+    `lod_scale` is the number of pixels per unit the SVG will be drawn at.
+    When it is small, compact strokes are simplified for it, see `lod`.
+
+    Without `header`, only the body is written, to be drawn with different
+    views by prepending `svg_header` for each.
+
+    """
 
     if track_xy is None:
         track_xy = NotebookSizeTracker()
-    output = SvgWriter()
+    if debug is None:
+        debug = not compact
+
+    anchor_pos, text_lines = track_tree(tree, track_xy)
+
+    format_kwargs = track_xy.format_kwargs
 
     # add svg header
     # output.write('<svg xmlns="http://www.w3.org/2000/svg">\n')
-    output.write(SVG_HEADER)
+    if header:
+        output_file.write(SVG_HEADER.format(**format_kwargs))
 
-    output.write('    <g id="p1" style="display:inline" transform="translate({x_shift},0)">\n')
+    output_file.write(f'    <g id="p1" style="display:inline" transform="translate({format_kwargs["x_shift"]},0)">\n')
     # output.write('        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
 
-    # These special anchor IDs are for the top and bottom of the page.
-    anchor_pos = {
-        CrdtId(0, 281474976710654): 270,
-        CrdtId(0, 281474976710655): 700,
-    }
-    if tree.root_text is not None:
-        draw_text(tree.root_text, output, anchor_pos, track_xy)
+    if text_lines is not None:
+        draw_text(text_lines, output_file, debug)
 
-    draw_group(tree.root, output, anchor_pos, track_xy)
+    draw_group(tree.root, output_file, anchor_pos, compact, debug, lod_scale)
 
     # # Overlay the page with a clickable rect to flip pages
     # output.write('\n')
     # output.write('        <!-- clickable rect to flip pages -->\n')
     # output.write(f'        <rect x="0" y="0" width="{svg_doc_info.width}" height="{svg_doc_info.height}" fill-opacity="0"/>\n')
     # Closing page group
-    output.write('    </g>\n')
+    output_file.write('    </g>\n')
     # END notebook
-    output.write('</svg>\n')
-    output_file.write(output.format(**track_xy.format_kwargs))
+    output_file.write('</svg>\n')
+
+
+def track_tree(tree: SceneTree, track_xy: DocumentSizeTracker):
+    """Lay out the text and feed everything that is drawn to `track_xy`.
 
+    Returns the anchor positions and the text lines from `layout_text`, or
+    None for the lines if there is no root text.
 
-def draw_group(item: Group, output, anchor_pos, track_xy: DocumentSizeTracker):
+    """
+    anchor_pos = dict(PAGE_ANCHORS)
+    text_lines = None
+    if tree.root_text is not None:
+        text_lines = layout_text(tree.root_text, anchor_pos)
+        track_text(text_lines, track_xy)
+    track_group(tree.root, anchor_pos, track_xy)
+    return anchor_pos, text_lines
+
+
+def group_anchor(item: Group, anchor_pos) -> tuple[float, float]:
+    """Return the (x, y) translation of a group from its anchor."""
     anchor_x = 0.0
     anchor_y = 0.0
     if item.anchor_id is not None:
@@ -108,18 +143,45 @@ def draw_group(item: Group, output, anchor_pos, track_xy: DocumentSizeTracker):
         anchor_x = item.anchor_origin_x.value
         if item.anchor_id.value in anchor_pos:
             anchor_y = anchor_pos[item.anchor_id.value]
-    output.write(f'    <g id="{item.node_id}" transform="translate({track_xy.x(anchor_x)}, {track_xy.y(anchor_y)})">\n')
-    for child_id in item.children:
-        child = item.children[child_id]
-        output.write(f'    <!-- child {child_id} -->\n')
+    return anchor_x, anchor_y
+
+
+def track_group(item: Group, anchor_pos, track_xy: DocumentSizeTracker):
+    """Feed the coordinates drawn by `draw_group` to `track_xy`."""
+    anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    track_xy.x(anchor_x)
+    track_xy.y(anchor_y)
+    for child in item.children.ordered_values():
+        if isinstance(child, Group):
+            track_group(child, anchor_pos, track_xy)
+        elif isinstance(child, Line):
+            track_stroke(child, track_xy)
+
+
+def track_stroke(item: Line, track_xy: DocumentSizeTracker):
+    """Feed the extents of the stroke drawn by `draw_stroke` to `track_xy`."""
+    bbox = item.bbox()
+    if bbox is not None:
+        track_xy.track_bbox(*bbox)
+
+
+def draw_group(item: Group, output, anchor_pos, compact: bool = False, debug: bool = True, lod_scale: float = None):
+    anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    output.write(f'    <g id="{item.node_id}" transform="translate({anchor_x}, {anchor_y})">\n')
+    for child_id, child in item.children.items():
+        if debug:
+            output.write(f'    <!-- child {child_id} -->\n')
         if isinstance(child, Group):
-            draw_group(child, output, anchor_pos, track_xy=track_xy)
+            draw_group(child, output, anchor_pos, compact, debug, lod_scale)
         elif isinstance(child, Line):
-            draw_stroke(child, output, track_xy)
+            if compact:
+                draw_stroke_paths(child, output, debug, lod_scale)
+            else:
+                draw_stroke(child, output)
     output.write(f'    </g>\n')
 
 
-def draw_stroke(item: Line, output, track_xy: DocumentSizeTracker):
+def draw_stroke(item: Line, output):
     # initiate the pen
     pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale / 10)
     K = 5
@@ -134,21 +196,16 @@ def draw_stroke(item: Line, output, track_xy: DocumentSizeTracker):
     output.write(f'stroke-linejoin="{pen.stroke_linejoin}" ')
     output.write('points="')
 
+    styles = pen.segment_styles(item.points)
     last_xpos = -1.
     last_ypos = -1.
-    last_segment_width = segment_width = 0
     # Iterate through the point to form a polyline
     for point_id, point in enumerate(item.points):
         # align the original position
         xpos = point.x
         ypos = point.y
         if point_id % pen.segment_length == 0:
-            segment_color = pen.get_segment_color(point.speed, point.direction, point.width, point.pressure,
-                                                  last_segment_width)
-            segment_width = pen.get_segment_width(point.speed, point.direction, point.width, point.pressure,
-                                                  last_segment_width)
-            segment_opacity = pen.get_segment_opacity(point.speed, point.direction, point.width, point.pressure,
-                                                      last_segment_width)
+            segment_color, segment_width, segment_opacity = styles[point_id // pen.segment_length]
             # print(segment_color, segment_width, segment_opacity, pen.stroke_linecap)
             # UPDATE stroke
             output.write('"/>\n')
@@ -160,39 +217,72 @@ def draw_stroke(item: Line, output, track_xy: DocumentSizeTracker):
             output.write('points="')
             if last_xpos != -1.:
                 # Join to previous segment
-                output.write(a := f'{track_xy.x(last_xpos):.3f},{track_xy.y(last_ypos, ):.3f} ')
+                output.write(f'{last_xpos:.3f},{last_ypos:.3f} ')
         # store the last position
         last_xpos = xpos
         last_ypos = ypos
-        last_segment_width = segment_width
 
         # BEGIN and END polyline segment
-        output.write(f'{track_xy.x(xpos):.3f},{track_xy.y(ypos):.3f} ')
+        output.write(f'{xpos:.3f},{ypos:.3f} ')
 
     # END stroke
     output.write('" />\n')
 
 
-def draw_text(text: Union[Text, TextDocument], output, anchor_pos, track_xy: DocumentSizeTracker):
+def draw_stroke_paths(item: Line, output, debug: bool = False, lod_scale: float = None):
+    """Draw a stroke as one `<path>` per run of segments with the same style.
+
+    The pen is evaluated for the same segments as in `draw_stroke`, but
+    consecutive segments that come out with the same color, width and opacity
+    are merged, and the coordinates are formatted in one go. With a small
+    `lod_scale`, only the points of the simplified runs are drawn.
+
+    """
+    pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale / 10)
+    K = 5
+
+    points = item.points
+    if isinstance(points, PointStore):
+        xs, ys = points.x, points.y
+    else:
+        xs = [point.x for point in points]
+        ys = [point.y for point in points]
+    coordinate = '{:.3f},{:.3f}'.format
+    coordinates = None
+
+    if debug:
+        output.write(
+            f'        <!-- Stroke tool: {item.tool.name} color: {item.color.name} thickness_scale: {item.thickness_scale} -->\n')
+
+    def format_style(style):
+        return f'fill:none;stroke:{style[0]};stroke-width:{style[1] / K:.3f};opacity:{style[2]}'
+
+    for style, indices in stroke_runs(item, pen, lod_scale, format_style):
+        if isinstance(indices, range):
+            if coordinates is None:
+                coordinates = list(map(coordinate, xs, ys))
+            parts = coordinates[indices.start:indices.stop]
+        else:
+            parts = [coordinate(xs[index], ys[index]) for index in indices]
+        path = 'M' + parts[0]
+        if len(parts) > 1:
+            path += ' L' + ' '.join(parts[1:])
+        output.write(
+            f'        <path d="{path}" style="{format_style(style)}" '
+            f'stroke-linecap="{pen.stroke_linecap}" stroke-linejoin="{pen.stroke_linejoin}"/>\n')
+
+
+def layout_text(text: Union[Text, TextDocument], anchor_pos) -> list[tuple[float, float, str, str, CrdtId]]:
+    """Position the lines of `text`.
+
+    Returns `(x, y, class, line, first char id)` for each non-empty line, and
+    saves the y-coordinates of potential anchors in `anchor_pos`.
+
+    """
     if isinstance(text, Text):
         text = TextDocument.from_scene_item(text)
-    output.write('    <g class="root-text" style="display:inline">\n')
-
-    # add some style to get readable text
-    output.write('''
-    <style>
-        text.heading {{
-            font: 14pt serif;
-        }}
-        text.bold {{
-            font: 8pt sans-serif bold;
-        }}
-        text, text.plain {{
-            font: 7pt sans-serif;
-        }}
-    </style>
-    ''')
 
+    lines = []
     y_offset = TEXT_TOP_Y
     pos_x = 0
     pos_y = 0
@@ -209,12 +299,44 @@ def draw_text(text: Union[Text, TextDocument], output, anchor_pos, track_xy: Doc
         pos_y += y_offset
         cls = fmt.name.lower()
         if line:
-            output.write(f'        <!-- Text line char_id: {ids[0]} -->\n')
-            output.write(
-                f'        <text x="{track_xy.x(pos_x)}" y="{track_xy.y(pos_y)}" class="{cls}">{line.strip()}</text>\n')
+            lines.append((pos_x, pos_y, cls, line, ids[0]))
 
         # Save y-coordinates of potential anchors
         for k in ids:
             anchor_pos[k] = pos_y
 
+    return lines
+
+
+def track_text(text_lines, track_xy: DocumentSizeTracker):
+    """Feed the coordinates drawn by `draw_text` to `track_xy`."""
+    for pos_x, pos_y, *_ in text_lines:
+        track_xy.x(pos_x)
+        track_xy.y(pos_y)
+
+
+def draw_text(text_lines, output, debug: bool = True):
+    output.write('    <g class="root-text" style="display:inline">\n')
+
+    # add some style to get readable text
+    output.write('''
+    <style>
+        text.heading {
+            font: 14pt serif;
+        }
+        text.bold {
+            font: 8pt sans-serif bold;
+        }
+        text, text.plain {
+            font: 7pt sans-serif;
+        }
+    </style>
+    ''')
+
+    for pos_x, pos_y, cls, line, char_id in text_lines:
+        if debug:
+            output.write(f'        <!-- Text line char_id: {char_id} -->\n')
+        output.write(
+            f'        <text x="{pos_x}" y="{pos_y}" class="{cls}">{line.strip()}</text>\n')
+
     output.write('    </g>\n')
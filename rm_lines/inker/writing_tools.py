@@ -5,6 +5,14 @@ https://github.com/chemag/maxio .
 """
 
 import math
+from functools import lru_cache
+
+from ..scene_items import PointStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # color_id to RGB conversion
 # 1. we use "color_id" for a unique, proprietary ID for colors,
@@ -31,11 +39,85 @@ remarkable_palette = {
 }
 MAGIC_PENCIL_SIZE = 44.6 * 2.3
 
+# Strokes with fewer segments are evaluated with plain Python, as numpy's
+# overhead per call outweighs its savings per element
+VECTORIZE_MIN_SEGMENTS = 16
+
+
+def segment_columns(points, segment_length) -> tuple:
+    """Return the speed, direction, width and pressure at the start of each segment.
+
+    The columns are float64 numpy arrays for long strokes if numpy is
+    available, and lists of numbers otherwise.
+
+    """
+    if isinstance(points, PointStore):
+        columns = (points.speed, points.direction, points.width, points.pressure)
+        if np is not None and len(points) >= VECTORIZE_MIN_SEGMENTS * segment_length:
+            return tuple(np.frombuffer(column, column.typecode)[::segment_length].astype(np.float64)
+                         for column in columns)
+        return tuple(column[::segment_length].tolist() for column in columns)
+
+    points = points[::segment_length]
+    columns = ([point.speed for point in points], [point.direction for point in points],
+               [point.width for point in points], [point.pressure for point in points])
+    if np is not None and len(points) >= VECTORIZE_MIN_SEGMENTS:
+        return tuple(np.array(column, np.float64) for column in columns)
+    return columns
+
+
+def evaluate(formula, columns) -> list:
+    """Apply an element-wise `formula` to the columns from `segment_columns`.
+
+    `formula` is called once with the arrays if the columns are numpy arrays,
+    and once per segment otherwise. A formula may return a constant.
+
+    """
+    if np is not None and isinstance(columns[0], np.ndarray):
+        values = formula(*columns)
+        if isinstance(values, np.ndarray):
+            return values.tolist()
+        return [values] * len(columns[0])
+    return list(map(formula, *columns))
+
+
+def _maximum(value, minimum):
+    if np is not None and isinstance(value, np.ndarray):
+        return np.maximum(value, minimum)
+    return value if value > minimum else minimum
+
+
+def _minimum(value, maximum):
+    if np is not None and isinstance(value, np.ndarray):
+        return np.minimum(value, maximum)
+    return value if value < maximum else maximum
+
+
+def _where(condition, value, otherwise):
+    if np is not None and isinstance(condition, np.ndarray):
+        return np.where(condition, value, otherwise)
+    return value if condition else otherwise
+
+
+def _exact_ints(values: list) -> list:
+    """Turn 0.0 and 1.0 into ints, as the clamped formulas return ints."""
+    return [int(value) if value == 0 or value == 1 else value for value in values]
+
 
 class Pen:
+    """A writing tool, mapping the points of a stroke to segment styles.
+
+    Pens hold no state besides their parameters, so `create` shares them
+    between strokes with the same tool, color and thickness. The
+    `get_segment_*` formulas are element-wise: they are called with numbers
+    or with numpy arrays of the values for every segment of a stroke.
+
+    """
+
     def __init__(self, base_width, base_color_id):
         self.base_width = base_width
         self.base_color = remarkable_palette[base_color_id]
+        self.color = self.format_color(self.base_color)
         self.segment_length = 1000
         self.base_opacity = 1
         self.name = "Basic Pen"
@@ -45,6 +127,12 @@ class Pen:
         self.stroke_opacity = 1
         self.stroke_width = base_width
         self.stroke_color = base_color_id
+        # Part of the previous segment width added to a segment, see `segment_styles`
+        self.last_width_factor = 0
+
+    @staticmethod
+    def format_color(color) -> str:
+        return "rgb" + str(tuple(color))
 
     # note that the units of the points have had their units converted
     # in scene_stream.py
@@ -62,22 +150,74 @@ class Pen:
     # pressure = d.read_float32() * 255
     # ---> replace pressure with pressure / 255 [input]
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
+    def get_segment_width(self, speed, direction, width, pressure):
         return self.base_width
 
-    def get_segment_color(self, speed, direction, width, pressure, last_width):
-        return "rgb" + str(tuple(self.base_color))
+    def get_segment_intensity(self, speed, direction, width, pressure):
+        """Return the factor for the base color, or None to use it as is."""
+        return None
 
-    def get_segment_opacity(self, speed, direction, width, pressure, last_width):
+    def get_segment_opacity(self, speed, direction, width, pressure):
         return self.base_opacity
 
     def cutoff(self, value):
         """must be between 1 and 0"""
+        if np is not None and isinstance(value, np.ndarray):
+            return np.clip(value, 0, 1)
         value = 1 if value > 1 else value
         value = 0 if value < 0 else value
         return value
 
+    def segment_styles(self, points) -> list[tuple[str, float, float]]:
+        """Return the (color, width, opacity) of each segment of a stroke.
+
+        A segment starts every `segment_length` points, and its style comes
+        from the values of its first point.
+
+        """
+        columns = segment_columns(points, self.segment_length)
+        widths = evaluate(self.get_segment_width, columns)
+        if self.last_width_factor:
+            last_width = 0
+            for segment, width in enumerate(widths):
+                last_width = widths[segment] = width + (self.last_width_factor * last_width)
+
+        intensities = evaluate(self.get_segment_intensity, columns)
+        if intensities and intensities[0] is not None:
+            # using segment color not opacity because the dots interfere with each other.
+            # Color must be 255 rgb
+            colors = [self.format_color([int(intensity * i) for i in self.base_color])
+                      for intensity in intensities]
+        else:
+            colors = [self.color] * len(widths)
+
+        opacities = _exact_ints(evaluate(self.get_segment_opacity, columns))
+        return list(zip(colors, widths, opacities))
+
+    def segment_runs(self, points, key=None) -> list[list]:
+        """Merge the segments of a stroke into runs of the same style.
+
+        Returns `[style, first point, end point]` for each run, where the
+        first point is the last point of the previous run so that the runs
+        join up. Segments are merged if `key(style)` is equal, and the run
+        takes the style of its first segment.
+
+        """
+        runs = []
+        segment_length = self.segment_length
+        last_key = None
+        for segment, style in enumerate(self.segment_styles(points)):
+            style_key = style if key is None else key(style)
+            start = segment * segment_length
+            if runs and last_key == style_key:
+                runs[-1][2] = start + segment_length
+            else:
+                runs.append([style, max(start - 1, 0), start + segment_length])
+                last_key = style_key
+        return runs
+
     @classmethod
+    @lru_cache(maxsize=256)
     def create(cls, pen_nr, color_id, width):
         # print(f'----> create(cls, pen_nr: {pen_nr}, color_id: {color_id}, width: {width})')
         # Brush
@@ -129,7 +269,6 @@ class Ballpoint(Pen):
         super().__init__(base_width, base_color_id)
         self.segment_length = 5
         self.name = "Ballpoint"
-        self.alternate = 0  # 0 or 1
         """
         The pen is both solid but has different densities.
         To make this work, we alternate between the a solid smaller size and a opaque larger size
@@ -137,23 +276,27 @@ class Ballpoint(Pen):
 
     #     TODO: Maybe implement a way for pens to have densities
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
+    def get_segment_width(self, speed, direction, width, pressure):
         segment_width = (0.5 + pressure / 100) + (1 * width / 4) - 0.5 * ((speed / 4) / 50)
         segment_width *= 2
-        intensity = self.get_intensity(speed, pressure)
-        return segment_width * (1 if self.alternate == 0 else intensity) * 2.3
+        return segment_width
 
-    def get_intensity(self, speed, pressure):
+    def get_intensity(self, speed, direction, width, pressure):
         return self.cutoff((0.1 * - ((speed / 4) / 35)) + (1.2 * pressure / 255) + 0.5)
 
-    def get_segment_opacity(self, speed, direction, width, pressure, last_width):
-        intensity = self.get_intensity(speed, pressure)
-        if self.alternate == 0:
-            self.alternate = 1
-            return intensity
-        else:
-            self.alternate = 0
-            return 1
+    def segment_styles(self, points) -> list[tuple[str, float, float]]:
+        columns = segment_columns(points, self.segment_length)
+        widths = evaluate(self.get_segment_width, columns)
+        intensities = _exact_ints(evaluate(self.get_intensity, columns))
+        styles = []
+        for segment, (segment_width, intensity) in enumerate(zip(widths, intensities)):
+            # Even segments are solid with the intensity as opacity, odd
+            # segments are opaque with the width scaled by the intensity
+            if segment % 2 == 0:
+                styles.append((self.color, segment_width * 1 * 2.3, intensity))
+            else:
+                styles.append((self.color, segment_width * intensity * 2.3, 1))
+        return styles
 
     # def get_segment_color(self, speed, direction, width, pressure, last_width):
     #     segment_color = tuple(int(v * alpha) for v in self.base_color)
@@ -170,10 +313,11 @@ class Marker(Pen):
     def __init__(self, base_width, base_color_id):
         super().__init__(base_width, base_color_id)
         self.segment_length = 3
+        self.last_width_factor = 0.1
         self.name = "Marker"
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
-        segment_width = 3.36 * ((width / 4) - 0.4 * self.direction_to_tilt(direction)) + (0.1 * last_width)
+    def get_segment_width(self, speed, direction, width, pressure):
+        segment_width = 3.36 * ((width / 4) - 0.4 * self.direction_to_tilt(direction))
         return segment_width
 
 
@@ -183,15 +327,15 @@ class Pencil(Pen):
         self.segment_length = 2
         self.name = "Pencil"
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
+    def get_segment_width(self, speed, direction, width, pressure):
         segment_width = 10 * ((((0.8 * self.base_width) + (0.5 * pressure / 255)) * (width / 3)) - (
                 0.25 * self.direction_to_tilt(direction) ** 2.1) - (0.6 * (speed / 4) / 10))
         # segment_width = 1.3*(((self.base_width * 0.4) * pressure) - 0.5 * ((self.direction_to_tilt(direction) ** 0.5)) + (0.5 * last_width))
         max_width = self.base_width * MAGIC_PENCIL_SIZE
-        segment_width = segment_width if segment_width < max_width else max_width
-        return max(3, segment_width)
+        segment_width = _minimum(segment_width, max_width)
+        return _maximum(segment_width, 3)
 
-    def get_segment_opacity(self, speed, direction, width, pressure, last_width):
+    def get_segment_opacity(self, speed, direction, width, pressure):
         segment_opacity = (0.1 * - ((speed / 4) / 35)) + (1 * pressure / 255)
         segment_opacity = self.cutoff(segment_opacity) - 0.1
         return segment_opacity
@@ -205,15 +349,12 @@ class MechanicalPencil(Pen):
         self.segment_length = 2
         self.name = "Mechanical Pencil"
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
-        width = super().get_segment_width(speed, direction, width, pressure, last_width)
+    def get_segment_width(self, speed, direction, width, pressure):
+        width = super().get_segment_width(speed, direction, width, pressure)
         return max(5, width)
 
-    def get_segment_opacity(self, speed, direction, width, pressure, last_width):
-        if direction / 255 < 0.5:
-            return max(0.3, self.cutoff(speed / 50 * pressure / 255))
-        else:
-            return 0.85
+    def get_segment_opacity(self, speed, direction, width, pressure):
+        return _where(direction / 255 < 0.5, _maximum(self.cutoff(speed / 50 * pressure / 255), 0.3), 0.85)
 
 
 class Brush(Pen):
@@ -224,20 +365,15 @@ class Brush(Pen):
         self.opacity = 1
         self.name = "Brush"
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
+    def get_segment_width(self, speed, direction, width, pressure):
         segment_width = 1.68 * (
                 ((1 + (1.4 * pressure / 255)) * (width / 4)) - (0.5 * self.direction_to_tilt(direction)) - (
                 (speed / 4) / 50))  # + (0.2 * last_width)
         return segment_width
 
-    def get_segment_color(self, speed, direction, width, pressure, last_width):
+    def get_segment_intensity(self, speed, direction, width, pressure):
         intensity = ((pressure / 255) ** 1.5 - 0.2 * ((speed / 4) / 50)) * 1.5
-        intensity = self.cutoff(intensity)
-        # using segment color not opacity because the dots interfere with each other.
-        # Color must be 255 rgb
-        segment_color = [int(intensity * i) for i in self.base_color]
-
-        return "rgb" + str(tuple(segment_color))
+        return self.cutoff(intensity)
 
 
 class Highlighter(Pen):
@@ -270,9 +406,9 @@ class Caligraphy(Pen):
     def __init__(self, base_width, base_color_id):
         super().__init__(base_width, base_color_id)
         self.segment_length = 2
+        self.last_width_factor = 0.1
         self.name = "Calligraphy"
 
-    def get_segment_width(self, speed, direction, width, pressure, last_width):
-        segment_width = 2.16 * (((1 + pressure / 255) * (width / 4)) - 0.3 * self.direction_to_tilt(direction)) + (
-                0.1 * last_width)
+    def get_segment_width(self, speed, direction, width, pressure):
+        segment_width = 2.16 * (((1 + pressure / 255) * (width / 4)) - 0.3 * self.direction_to_tilt(direction))
         return segment_width
@@ -11,7 +11,7 @@ import typing as tp
 
 from .exceptions import BlockOverflowError
 from ..tagged_block_common import (
-    DataStream,
+    data_stream,
     TagType,
     CrdtId,
     UnexpectedBlockError,
@@ -47,10 +47,15 @@ class SubBlockInfo(BlockInfo):
 
 
 class TaggedBlockReader:
-    """Read blocks and values from a remarkable v6 file stream."""
+    """Read blocks and values from a remarkable v6 file stream.
 
-    def __init__(self, data: tp.BinaryIO):
-        rm_data = DataStream(data)
+    `data` may be a binary file-like object or the file contents as `bytes`,
+    in which case a buffer-backed `BufferDataStream` is used.
+
+    """
+
+    def __init__(self, data: tp.Union[tp.BinaryIO, bytes, bytearray, memoryview]):
+        rm_data = data_stream(data)
         self.data = rm_data
         self.current_block: tp.Optional[MainBlockInfo] = None
 
@@ -103,47 +108,46 @@ class TaggedBlockReader:
 
     ## Read simple values -- optional variants
 
-    def _read_optional(self, func, index, default):
-        try:
+    def _read_optional(self, func, index, tag_type, default):
+        if self.data.check_tag(index, tag_type):
             return func(index)
-        except (UnexpectedBlockError, EOFError):
-            return default
+        return default
 
     def read_id_optional(
             self, index: int, default: tp.Optional[CrdtId] = None
     ) -> tp.Optional[CrdtId]:
         """Read a tagged CRDT ID, return `default` if not present."""
-        return self._read_optional(self.read_id, index, default)
+        return self._read_optional(self.read_id, index, TagType.ID, default)
 
     def read_bool_optional(
             self, index: int, default: tp.Optional[bool] = None
     ) -> tp.Optional[bool]:
         """Read a tagged bool, return `default` if not present."""
-        return self._read_optional(self.read_bool, index, default)
+        return self._read_optional(self.read_bool, index, TagType.Byte1, default)
 
     def read_byte_optional(
             self, index: int, default: tp.Optional[int] = None
     ) -> tp.Optional[int]:
         """Read a tagged byte as an unsigned integer, return `default` if not present."""
-        return self._read_optional(self.read_byte, index, default)
+        return self._read_optional(self.read_byte, index, TagType.Byte1, default)
 
     def read_int_optional(
             self, index: int, default: tp.Optional[int] = None
     ) -> tp.Optional[int]:
         """Read a tagged 4-byte unsigned integer, return `default` if not present."""
-        return self._read_optional(self.read_int, index, default)
+        return self._read_optional(self.read_int, index, TagType.Byte4, default)
 
     def read_float_optional(
             self, index: int, default: tp.Optional[float] = None
     ) -> tp.Optional[float]:
         """Read a tagged 4-byte float, return `default` if not present."""
-        return self._read_optional(self.read_float, index, default)
+        return self._read_optional(self.read_float, index, TagType.Byte4, default)
 
     def read_double_optional(
             self, index: int, default: tp.Optional[float] = None
     ) -> tp.Optional[float]:
         """Read a tagged 8-byte double, return `default` if not present."""
-        return self._read_optional(self.read_double, index, default)
+        return self._read_optional(self.read_double, index, TagType.Byte8, default)
 
     ## Blocks
 
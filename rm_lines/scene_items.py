@@ -1,16 +1,19 @@
 """Data structures for the contents of a scene."""
 
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
 import enum
 import typing as tp
 
-from .tagged_block_common import CrdtId, LwwValue
+from .tagged_block_common import CrdtId, LwwValue, add_slots
 from .crdt_sequence import CrdtSequence
 
 
 ## Base class
 
 
+@add_slots
 @dataclass
 class SceneItem:
     """Base class for items stored in scene tree."""
@@ -19,6 +22,7 @@ class SceneItem:
 ## Group
 
 
+@add_slots
 @dataclass
 class Group(SceneItem):
     """A Group represents a group of nested items.
@@ -105,6 +109,7 @@ class Pen(enum.IntEnum):
         return value in (cls.HIGHLIGHTER_1, cls.HIGHLIGHTER_2)
 
 
+@add_slots
 @dataclass
 class Point:
     x: float
@@ -115,15 +120,118 @@ class Point:
     pressure: int
 
 
+class PointStore(Sequence):
+    """Columnar storage for the points of a `Line`.
+
+    Each `Point` attribute is kept in its own `array`, so a stroke with many
+    points doesn't hold a `Point` object per sample. Indexing and iterating
+    build `Point` objects on demand, so code written against a list of points
+    keeps working.
+
+    """
+
+    __slots__ = ("x", "y", "speed", "direction", "width", "pressure")
+
+    # Array typecodes matching the v2 point encoding. Version 1 points store
+    # scaled floats for speed, direction and pressure instead.
+    TYPECODES_V1 = ("f", "f", "d", "d", "i", "d")
+    TYPECODES_V2 = ("f", "f", "H", "B", "H", "B")
+
+    def __init__(self, x: array, y: array, speed: array, direction: array, width: array, pressure: array):
+        self.x = x
+        self.y = y
+        self.speed = speed
+        self.direction = direction
+        self.width = width
+        self.pressure = pressure
+
+    @classmethod
+    def empty(cls, typecodes: tp.Sequence[str] = TYPECODES_V2) -> "PointStore":
+        return cls(*(array(typecode) for typecode in typecodes))
+
+    @classmethod
+    def from_points(cls, points: tp.Iterable[Point], typecodes: tp.Sequence[str] = TYPECODES_V2) -> "PointStore":
+        store = cls.empty(typecodes)
+        for point in points:
+            store.append(point)
+        return store
+
+    def columns(self) -> tuple[array, ...]:
+        """Return the columns in `Point` field order."""
+        return self.x, self.y, self.speed, self.direction, self.width, self.pressure
+
+    def append(self, point: Point):
+        self.x.append(point.x)
+        self.y.append(point.y)
+        self.speed.append(point.speed)
+        self.direction.append(point.direction)
+        self.width.append(point.width)
+        self.pressure.append(point.pressure)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PointStore(*(column[index] for column in self.columns()))
+        return Point(self.x[index], self.y[index], self.speed[index],
+                     self.direction[index], self.width[index], self.pressure[index])
+
+    def __iter__(self) -> tp.Iterator[Point]:
+        return map(Point, *self.columns())
+
+    def __eq__(self, other):
+        if isinstance(other, PointStore):
+            return all(a.tolist() == b.tolist() for a, b in zip(self.columns(), other.columns()))
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "PointStore(%d points)" % len(self)
+
+
+@add_slots
 @dataclass
 class Line(SceneItem):
+    """A stroke.
+
+    `points` is either a list of `Point`s or, for lines read from a file, a
+    `PointStore` which behaves like one.
+
+    """
+
     color: PenColor
     tool: Pen
-    points: list[Point]
+    points: tp.Union[list[Point], PointStore]
     thickness_scale: float
     starting_length: float
     move_id: tp.Optional[CrdtId] = None
 
+    # (points, number of points, bbox) of the last `bbox` call. A factory, as
+    # slotted classes can't fall back to a class attribute default.
+    _bbox: tp.Optional[tuple] = field(default_factory=lambda: None, init=False, repr=False, compare=False)
+
+    def bbox(self) -> tp.Optional[tuple[float, float, float, float]]:
+        """Return `(min_x, min_y, max_x, max_y)` of the points, or None if empty.
+
+        The result is cached until `points` is replaced or changes length.
+
+        """
+        points = self.points
+        cached = self._bbox
+        if cached is not None and cached[0] is points and cached[1] == len(points):
+            return cached[2]
+
+        if isinstance(points, PointStore):
+            xs, ys = points.x, points.y
+        else:
+            xs = [point.x for point in points]
+            ys = [point.y for point in points]
+        bbox = (min(xs), min(ys), max(xs), max(ys)) if len(xs) else None
+        self._bbox = (points, len(points), bbox)
+        return bbox
+
 
 ## Text
 
@@ -147,6 +255,7 @@ class ParagraphStyle(enum.IntEnum):
 END_MARKER = CrdtId(0, 0)
 
 
+@add_slots
 @dataclass
 class Text(SceneItem):
     """Block of text.
@@ -176,6 +285,7 @@ class Text(SceneItem):
 ## Glyph range
 
 
+@add_slots
 @dataclass
 class Rectangle:
     x: float
@@ -184,6 +294,7 @@ class Rectangle:
     h: float
 
 
+@add_slots
 @dataclass
 class GlyphRange(SceneItem):
     """Highlighted text
@@ -46,7 +46,7 @@ class SceneTree:
 
 def _walk_items(item):
     if isinstance(item, si.Group):
-        for child in item.children.values():
+        for child in item.children.ordered_values():
             yield from _walk_items(child)
     else:
         yield item
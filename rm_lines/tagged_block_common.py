@@ -6,7 +6,7 @@ from __future__ import annotations
 
 from collections.abc import Iterator
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from io import BytesIO
 import enum
 import logging
@@ -25,10 +25,51 @@ class TagType(enum.IntEnum):
     Byte1 = 0x1
 
 
+_TAG_TYPE_VALUES = frozenset(tag_type.value for tag_type in TagType)
+
+
 class UnexpectedBlockError(Exception):
     """Unexpected tag or index in block stream."""
 
 
+def _frozen_getstate(self):
+    return [getattr(self, name) for name in self.__slots__]
+
+
+def _frozen_setstate(self, state):
+    for name, value in zip(self.__slots__, state):
+        object.__setattr__(self, name, value)
+
+
+def add_slots(cls):
+    """Recreate dataclass `cls` with `__slots__` for the fields it declares.
+
+    This is `@dataclass(slots=True)` for Python versions before 3.10: the
+    instances have no `__dict__`, which saves memory for the small objects
+    a scene holds a lot of. Apply it on top of `@dataclass`, and to every
+    dataclass in a hierarchy, otherwise the base class still brings a
+    `__dict__` along.
+
+    """
+    cls_dict = dict(cls.__dict__)
+    own = cls_dict.get("__annotations__", {})
+    field_names = tuple(f.name for f in fields(cls) if f.name in own)
+    cls_dict["__slots__"] = field_names
+    for name in field_names:
+        # Defaults live in the generated __init__, not as class attributes
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    if cls.__dataclass_params__.frozen:
+        # The default pickle state would be restored with the frozen __setattr__
+        cls_dict["__getstate__"] = _frozen_getstate
+        cls_dict["__setstate__"] = _frozen_setstate
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+@add_slots
 @dataclass(eq=True, order=True, frozen=True)
 class CrdtId:
     """An identifier or timestamp."""
@@ -39,15 +80,36 @@ class CrdtId:
         return f"CrdtId({self.part1}, {self.part2})"
 
 
+_STRUCTS: dict[str, struct.Struct] = {}
+
+
+def _get_struct(pattern: str) -> struct.Struct:
+    """Return the precompiled little-endian `Struct` for `pattern`."""
+    try:
+        return _STRUCTS[pattern]
+    except KeyError:
+        compiled = _STRUCTS[pattern] = struct.Struct("<" + pattern)
+        return compiled
+
+
+for _pattern in "?BHIfd":
+    _get_struct(_pattern)
+
+
 class DataStream:
     """Read basic values from a remarkable v6 file stream."""
 
     def __init__(self, data: tp.BinaryIO):
         self.data = data
+        # (position, tag) of the last `peek_tag` lookahead
+        self._peeked: tp.Optional[tuple[int, tp.Optional[tuple[int, int, int]]]] = None
 
     def tell(self) -> int:
         return self.data.tell()
 
+    def seek(self, pos: int):
+        self.data.seek(pos)
+
     def read_header(self) -> None:
         """Read the file header.
 
@@ -73,14 +135,43 @@ class DataStream:
         advance the stream.
 
         """
-        pos = self.data.tell()
-        try:
-            index, tag_type = self._read_tag_values()
-            return (index == expected_index) and (tag_type == expected_type)
-        except (ValueError, EOFError):
-            return False
-        finally:
-            self.data.seek(pos)  # Go back
+        tag = self.peek_tag()
+        return tag is not None and tag[0] == expected_index and tag[1] == expected_type
+
+    def peek_tag(self) -> tp.Optional[tuple[int, int, int]]:
+        """Decode the next tag without advancing the stream.
+
+        Returns `(index, tag_type, end_position)`, or None if no valid tag can
+        be read here. The lookahead is cached until the position changes, so
+        an optional read followed by the real read only decodes the tag once.
+
+        """
+        pos = self.tell()
+        peeked = self._peeked
+        if peeked is None or peeked[0] != pos:
+            peeked = self._peeked = (pos, self._decode_tag())
+        return peeked[1]
+
+    def _decode_tag(self) -> tp.Optional[tuple[int, int, int]]:
+        """Decode the tag at the current position, then rewind."""
+        pos = self.tell()
+        x = 0
+        shift = 0
+        while True:
+            b = self.data.read(1)
+            if not b:
+                self.seek(pos)
+                return None
+            i = b[0]
+            x |= (i & 0x7F) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        end = self.tell()
+        self.seek(pos)
+        if x & 0xF not in _TAG_TYPE_VALUES:
+            return None
+        return x >> 4, x & 0xF, end
 
     def read_tag(
             self, expected_index: int, expected_type: TagType
@@ -91,30 +182,33 @@ class DataStream:
         rewind the stream.
 
         """
-        pos = self.data.tell()
-        index, tag_type = self._read_tag_values()
+        tag = self.peek_tag()
+        if tag is None:
+            # Not a valid tag, so the full read raises the appropriate error
+            return self._read_tag_values()
+
+        index, tag_type, end = tag
+        if index == expected_index and tag_type == expected_type:
+            self.seek(end)
+            return index, expected_type
 
         if index != expected_index:
-            self.data.seek(pos)  # Go back
             raise UnexpectedBlockError(
                 "Expected index %d, got %d, at position %d"
-                % (expected_index, index, self.data.tell())
+                % (expected_index, index, self.tell())
             )
 
         if tag_type != expected_type:
-            self.data.seek(pos)  # Go back
             raise UnexpectedBlockError(
                 "Expected tag type %s (0x%X), got 0x%X at position %d"
                 % (
                     expected_type.name,
                     expected_type.value,
                     tag_type,
-                    self.data.tell(),
+                    self.tell(),
                 )
             )
 
-        return index, tag_type
-
     def _read_tag_values(self) -> tuple[int, TagType]:
         """Read tag values from the stream."""
 
@@ -130,7 +224,7 @@ class DataStream:
             tag_type = TagType(tag_type)
         except ValueError as e:
             raise ValueError(
-                "Bad tag type 0x%X at position %d" % (tag_type, self.data.tell())
+                "Bad tag type 0x%X at position %d" % (tag_type, self.tell())
             )
 
         return index, tag_type
@@ -152,13 +246,11 @@ class DataStream:
         self.data.write(b)
 
     def _read_struct(self, pattern: str):
-        pattern = "<" + pattern
-        n = struct.calcsize(pattern)
-        return struct.unpack(pattern, self.read_bytes(n))[0]
+        compiled = _get_struct(pattern)
+        return compiled.unpack(self.read_bytes(compiled.size))[0]
 
     def _write_struct(self, pattern: str, value):
-        pattern = "<" + pattern
-        self.data.write(struct.pack(pattern, value))
+        self.write_bytes(_get_struct(pattern).pack(value))
 
     def read_bool(self) -> bool:
         """Read a bool from the data stream."""
@@ -241,7 +333,7 @@ class DataStream:
             else:
                 b.append(to_write)
                 break
-        self.data.write(b)
+        self.write_bytes(b)
 
     def write_crdt_id(self, value: CrdtId):
         """Write a `CrdtId` to the data stream."""
@@ -254,11 +346,115 @@ class DataStream:
         # result = (part1 << 48) | part2
 
 
+class BufferDataStream(DataStream):
+    """Read and write basic values on an in-memory buffer.
+
+    Works on `bytes`, `bytearray` or `memoryview` data with a plain integer
+    cursor, so primitive reads are a single `unpack_from` on the buffer
+    instead of a `read()` that slices a fresh `bytes` object. Writing needs a
+    `bytearray`.
+
+    """
+
+    def __init__(self, data: tp.Union[bytes, bytearray, memoryview], pos: int = 0):
+        if isinstance(data, memoryview):
+            data = data.cast("B")
+        super().__init__(data)
+        self.pos = pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, pos: int):
+        self.pos = pos
+
+    def read_bytes(self, n: int) -> bytes:
+        "Read `n` bytes, raising `EOFError` if there are not enough."
+        pos = self.pos
+        end = pos + n
+        if end > len(self.data):
+            raise EOFError()
+        self.pos = end
+        return bytes(self.data[pos:end])
+
+    def write_bytes(self, b: bytes):
+        """Write bytes at the cursor, growing the buffer as needed."""
+        data = self._writable()
+        pos = self.pos
+        if pos == len(data):
+            # Appending is the common case and cheaper than a slice assignment
+            data.extend(b)
+        else:
+            data[pos:pos + len(b)] = b
+        self.pos = pos + len(b)
+
+    def _write_struct(self, pattern: str, value):
+        self.write_bytes(_get_struct(pattern).pack(value))
+
+    def _writable(self) -> bytearray:
+        if not isinstance(self.data, bytearray):
+            raise TypeError("Cannot write to a %s buffer, use a bytearray" % type(self.data).__name__)
+        return self.data
+
+    def _read_struct(self, pattern: str):
+        compiled = _get_struct(pattern)
+        try:
+            value = compiled.unpack_from(self.data, self.pos)[0]
+        except struct.error:
+            raise EOFError()
+        self.pos += compiled.size
+        return value
+
+    def _decode_tag(self) -> tp.Optional[tuple[int, int, int]]:
+        data = self.data
+        pos = self.pos
+        x = 0
+        shift = 0
+        while True:
+            if pos >= len(data):
+                return None
+            i = data[pos]
+            pos += 1
+            x |= (i & 0x7F) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        if x & 0xF not in _TAG_TYPE_VALUES:
+            return None
+        return x >> 4, x & 0xF, pos
+
+    def read_varuint(self) -> int:
+        """Read a varuint from the data stream."""
+        data = self.data
+        pos = self.pos
+        shift = 0
+        result = 0
+        while True:
+            if pos >= len(data):
+                raise EOFError()
+            i = data[pos]
+            pos += 1
+            result |= (i & 0x7F) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        self.pos = pos
+        return result
+
+
+def data_stream(data: tp.Union[tp.BinaryIO, bytes, bytearray, memoryview]) -> DataStream:
+    """Return a `BufferDataStream` for in-memory data, else a `DataStream`."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return BufferDataStream(data)
+    return DataStream(data)
+
+
 _T = tp.TypeVar("_T")
 
 
 # This makes sense to be frozen, since the value should not be changed without
 # updating the timestamp.
+@add_slots
 @dataclass(eq=True, frozen=True)
 class LwwValue(tp.Generic[_T]):
     "Container for a last-write-wins value."
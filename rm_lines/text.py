@@ -5,12 +5,14 @@
 from __future__ import annotations
 
 from collections.abc import Iterable
+from bisect import bisect_right
 from dataclasses import dataclass, field
+import heapq
 import typing as tp
 
 from . import scene_items as si
 from .tagged_block_common import CrdtId, LwwValue
-from .crdt_sequence import CrdtSequence, CrdtSequenceItem
+from .crdt_sequence import CrdtSequenceItem
 
 
 def expand_text_item(
@@ -61,6 +63,224 @@ def expand_text_items(
         yield from expand_text_item(item)
 
 
+class _TextRun:
+    """Characters with consecutive ids, ordered as a single node.
+
+    `value` is the text for a text run, an int for a formatting code or None
+    for `length` deleted characters. `left_id` is the left neighbour of the
+    first character, `right_id` the right neighbour of the last one.
+
+    """
+
+    __slots__ = (
+        "part1", "part2", "length", "value", "left_id", "right_id",
+        "deps", "dependents", "remaining", "level",
+    )
+
+    def __init__(self, part1, part2, length, value, left_id=None, right_id=None):
+        self.part1 = part1
+        self.part2 = part2
+        self.length = length
+        self.value = value
+        self.left_id = left_id
+        self.right_id = right_id
+        self.deps: set[_TextRun] = set()
+        self.dependents: list[_TextRun] = []
+        self.remaining = 0
+        self.level = 0
+
+    def ids(self, start: int = 0, stop: tp.Optional[int] = None) -> list[CrdtId]:
+        part1 = self.part1
+        part2 = self.part2
+        if stop is None:
+            stop = self.length
+        return [CrdtId(part1, part2 + k) for k in range(start, stop)]
+
+
+# Placeholder value of nodes that are only referenced, never emitted
+_VIRTUAL = object()
+
+
+class _RunIndex:
+    """Find the run containing a character id."""
+
+    def __init__(self, runs: list[_TextRun]):
+        by_part1: dict[int, list[_TextRun]] = {}
+        for run in runs:
+            by_part1.setdefault(run.part1, []).append(run)
+        self._index = {}
+        for part1, part1_runs in by_part1.items():
+            part1_runs.sort(key=lambda run: run.part2)
+            self._index[part1] = ([run.part2 for run in part1_runs], part1_runs)
+
+    def find(self, char_id: CrdtId) -> tp.Optional[tuple[_TextRun, int]]:
+        """Return `(run, offset)` of the character with `char_id`, if any."""
+        entry = self._index.get(char_id.part1)
+        if entry is None:
+            return None
+        starts, runs = entry
+        i = bisect_right(starts, char_id.part2) - 1
+        if i < 0:
+            return None
+        run = runs[i]
+        offset = char_id.part2 - run.part2
+        if offset < run.length:
+            return run, offset
+        return None
+
+
+def _split_text_runs(items: Iterable[CrdtSequenceItem[str | int]]) -> list[_TextRun]:
+    """Make runs from text items, split where another item points inside.
+
+    After splitting, every left id that refers to a run points at its last
+    character and every right id at its first character, so runs can be
+    ordered as whole nodes.
+
+    """
+    runs = []
+    for item in items:
+        if item.deleted_length > 0:
+            assert item.value == ""
+            value, length = None, item.deleted_length
+        elif isinstance(item.value, int):
+            value, length = item.value, 1
+        else:
+            value, length = item.value, len(item.value)
+        if length:
+            item_id = item.item_id
+            runs.append(_TextRun(item_id.part1, item_id.part2, length, value,
+                                 item.left_id, item.right_id))
+
+    index = _RunIndex(runs)
+    splits: dict[_TextRun, set[int]] = {}
+    for run in runs:
+        if run.left_id != si.END_MARKER and (found := index.find(run.left_id)):
+            target, offset = found
+            if offset + 1 < target.length:
+                splits.setdefault(target, set()).add(offset + 1)
+        if run.right_id != si.END_MARKER and (found := index.find(run.right_id)):
+            target, offset = found
+            if offset > 0:
+                splits.setdefault(target, set()).add(offset)
+    if not splits:
+        return runs
+
+    pieces = []
+    for run in runs:
+        offsets = splits.get(run)
+        if offsets is None:
+            pieces.append(run)
+            continue
+        bounds = [0, *sorted(offsets), run.length]
+        part1, part2 = run.part1, run.part2
+        for start, stop in zip(bounds, bounds[1:]):
+            value = run.value[start:stop] if isinstance(run.value, str) else run.value
+            left_id = run.left_id if start == 0 else CrdtId(part1, part2 + start - 1)
+            right_id = run.right_id if stop == run.length else CrdtId(part1, part2 + stop)
+            pieces.append(_TextRun(part1, part2 + start, stop - start, value, left_id, right_id))
+    return pieces
+
+
+def _ordered_text_runs(
+        items: Iterable[CrdtSequenceItem[str | int]],
+) -> tp.Iterator[tuple[tp.Union[str, int, None], list[CrdtId]]]:
+    """Order text items without expanding them into single characters.
+
+    Yields `(value, ids)` chunks in document order, where `value` is a string,
+    a formatting code, or None for deleted characters. The order is the same
+    as `toposort_items` over `expand_text_items(items)`: a character's level
+    is one more than the highest level it depends on, so a run at level `l`
+    covers levels `l` to `l + length - 1`, and characters are emitted by
+    `(level, id)`. Runs whose levels overlap are interleaved character by
+    character; everything else is emitted as a whole run.
+
+    """
+    runs = _split_text_runs(items)
+    index = _RunIndex(runs)
+    virtual: dict[tp.Any, _TextRun] = {}
+
+    def node(char_id: CrdtId, side: str) -> _TextRun:
+        if char_id == si.END_MARKER:
+            key = side
+        elif found := index.find(char_id):
+            return found[0]
+        else:
+            key = char_id
+        if key not in virtual:
+            virtual[key] = _TextRun(0, 0, 1, _VIRTUAL)
+        return virtual[key]
+
+    for run in runs:
+        run.deps.add(node(run.left_id, "__start"))
+        node(run.right_id, "__end").deps.add(run)
+
+    nodes = runs + list(virtual.values())
+    ready = []
+    for run in nodes:
+        run.remaining = len(run.deps)
+        for dep in run.deps:
+            dep.dependents.append(run)
+        if not run.deps:
+            ready.append(run)
+
+    # Kahn's algorithm; each dependency sits on the last character of a run
+    i = 0
+    while i < len(ready):
+        run = ready[i]
+        i += 1
+        level = run.level + run.length
+        for dependent in run.dependents:
+            if dependent.level < level:
+                dependent.level = level
+            dependent.remaining -= 1
+            if dependent.remaining == 0:
+                ready.append(dependent)
+
+    # Like `toposort_items`, stop at the end marker if nothing else is level
+    # with it, and complain if that leaves anything behind.
+    stop = None
+    end = virtual.get("__end")
+    if end is not None and end.remaining == 0:
+        e = end.level
+        if not any(run is not end and run.level <= e < run.level + run.length for run in ready):
+            stop = e
+            if len(ready) != len(nodes) or any(
+                run is not end and run.level + run.length > e + 1 for run in ready
+            ):
+                raise ValueError("cyclic dependency")
+
+    emitted = []
+    for run in ready:
+        if run.value is _VIRTUAL:
+            continue
+        length = run.length if stop is None else min(run.length, stop - run.level)
+        if length > 0:
+            emitted.append((run.level, run.part1, run.part2, length, run))
+    emitted.sort(key=lambda x: x[:3])
+
+    def chars(numbered):
+        n, (level, part1, part2, length, run) = numbered
+        for k in range(length):
+            yield level + k, part1, part2 + k, n, run, k
+
+    i = 0
+    while i < len(emitted):
+        level, _, _, length, run = emitted[i]
+        group_end = level + length
+        j = i + 1
+        while j < len(emitted) and emitted[j][0] < group_end:
+            group_end = max(group_end, emitted[j][0] + emitted[j][3])
+            j += 1
+        if j == i + 1:
+            value = run.value[:length] if isinstance(run.value, str) else run.value
+            yield value, run.ids(0, length)
+        else:
+            for _, part1, part2, _, run, k in heapq.merge(*map(chars, enumerate(emitted[i:j]))):
+                value = run.value[k] if isinstance(run.value, str) else run.value
+                yield value, [CrdtId(part1, part2)]
+        i = j
+
+
 @dataclass
 class CrdtStr:
     """String with CrdtIds for chars and optional properties.
@@ -108,9 +328,6 @@ class TextDocument:
         if si.END_MARKER not in char_formats:
             char_formats[si.END_MARKER] = si.ParagraphStyle.PLAIN
 
-        # Expand from strings to characters
-        char_items = CrdtSequence(expand_text_items(text.items.sequence_items()))
-        keys = list(char_items)
         properties = {"font-weight": "normal", "font-style": "normal"}
 
         def handle_formatting_code(code):
@@ -124,38 +341,54 @@ class TextDocument:
                 properties["font-style"] = "normal"
             return properties
 
-        def parse_paragraph_contents():
-            if keys and char_items[keys[0]] == "\n":
-                start_id = keys.pop(0)
-            else:
-                start_id = si.END_MARKER
-            contents = []
-            while keys:
-                char = char_items[keys[0]]
-                if isinstance(char, int):
-                    handle_formatting_code(char)
-                elif char == "\n":
-                    # End of paragraph
-                    break
-                else:
-                    assert len(char) <= 1
-                    # Start a new string if text properties have changed
-                    if not contents or contents[-1].properties != properties:
-                        contents += [CrdtStr(properties=properties.copy())]
-                    contents[-1].s += char
-                    contents[-1].i += [keys[0]]
-                keys.pop(0)
-
-            return start_id, contents
-
         paragraphs = []
-        while keys:
-            start_id, contents = parse_paragraph_contents()
+        # Start id and contents of the paragraph being built, if any. A
+        # newline ends the current paragraph and starts the next one.
+        start_id = None
+        contents: list[CrdtStr] = []
+
+        def add_chars(s, ids):
+            nonlocal start_id, contents
+            if start_id is None:
+                start_id, contents = si.END_MARKER, []
+            # Start a new string if text properties have changed
+            if not contents or contents[-1].properties != properties:
+                contents.append(CrdtStr(properties=properties.copy()))
+            contents[-1].s += s
+            contents[-1].i += ids
+
+        def end_paragraph():
             if start_id in text.styles:
                 p = Paragraph(contents, start_id, text.styles[start_id])
             else:
                 p = Paragraph(contents, start_id)
-            paragraphs += [p]
+            paragraphs.append(p)
+
+        for value, ids in _ordered_text_runs(text.items.sequence_items()):
+            if isinstance(value, int):
+                if start_id is None:
+                    start_id, contents = si.END_MARKER, []
+                handle_formatting_code(value)
+                continue
+            if value is None:
+                # Deleted characters keep their ids but add no text
+                add_chars("", ids)
+                continue
+            pos = 0
+            while True:
+                newline = value.find("\n", pos)
+                stop = len(value) if newline < 0 else newline
+                if stop > pos:
+                    add_chars(value[pos:stop], ids[pos:stop])
+                if newline < 0:
+                    break
+                if start_id is not None:
+                    end_paragraph()
+                start_id, contents = ids[newline], []
+                pos = newline + 1
+
+        if start_id is not None:
+            end_paragraph()
 
         doc = cls(paragraphs)
         return doc
@@ -9,20 +9,32 @@ from __future__ import annotations
 
 from collections.abc import Iterator
 from contextlib import contextmanager
-from io import BytesIO
+import struct
 import typing as tp
 
 from ..tagged_block_common import (
     TagType,
     DataStream,
+    BufferDataStream,
     CrdtId,
     LwwValue,
     UnexpectedBlockError,
 )
 
 
+# Main block header: length, unknown byte, min version, current version, type
+_BLOCK_HEADER = struct.Struct("<IBBBB")
+_SUBBLOCK_LENGTH = struct.Struct("<I")
+
+
 class TaggedBlockWriter:
-    """Write blocks and values to a remarkable v6 file stream."""
+    """Write blocks and values to a remarkable v6 file stream.
+
+    Blocks and subblocks are written into a single growing buffer, with their
+    length fields reserved up front and filled in when they are closed. The
+    buffer is copied to the output stream once per top-level block.
+
+    """
 
     def __init__(self, data: tp.BinaryIO, options: tp.Optional[dict] = None):
         if options is None:
@@ -31,6 +43,8 @@ class TaggedBlockWriter:
         rm_data = DataStream(data)
         self.data = rm_data
         self._in_block: bool = False
+        self._buffer = bytearray()
+        self._buffer_data = BufferDataStream(self._buffer)
 
     def write_header(self) -> None:
         """Write the file header.
@@ -75,6 +89,30 @@ class TaggedBlockWriter:
 
     ## Blocks
 
+    @contextmanager
+    def _buffered(self) -> Iterator[None]:
+        """Accumulate writes in the buffer, flushing it when the outermost
+        buffered block is done."""
+        if self.data is self._buffer_data:
+            yield
+            return
+
+        previous_data = self.data
+        try:
+            self.data = self._buffer_data
+            yield
+            previous_data.write_bytes(self._buffer)
+        finally:
+            self.data = previous_data
+            del self._buffer[:]
+            self._buffer_data.seek(0)
+
+    def _reserve(self, size: int) -> int:
+        """Reserve `size` bytes to be backpatched, returning their position."""
+        pos = self.data.tell()
+        self.data.write_bytes(bytes(size))
+        return pos
+
     @contextmanager
     def write_block(
             self, block_type: int, min_version: int, current_version: int
@@ -88,25 +126,20 @@ class TaggedBlockWriter:
         if self._in_block:
             raise UnexpectedBlockError("Already in a block")
 
-        previous_data = self.data
-        block_buf = BytesIO()
-        block_data = DataStream(block_buf)
-        try:
-            self.data = block_data
-            self._in_block = True
-            yield
-        finally:
-            self.data = previous_data
-
-        assert self._in_block
-        self._in_block = False
-
-        self.data.write_uint32(len(block_buf.getbuffer()))
-        self.data.write_uint8(0)
-        self.data.write_uint8(min_version)
-        self.data.write_uint8(current_version)
-        self.data.write_uint8(block_type)
-        self.data.write_bytes(block_buf.getbuffer())
+        with self._buffered():
+            header_pos = self._reserve(_BLOCK_HEADER.size)
+            try:
+                self._in_block = True
+                yield
+            finally:
+                assert self._in_block
+                self._in_block = False
+
+            length = self.data.tell() - header_pos - _BLOCK_HEADER.size
+            _BLOCK_HEADER.pack_into(
+                self._buffer, header_pos,
+                length, 0, min_version, current_version, block_type
+            )
 
     @contextmanager
     def write_subblock(self, index: int) -> Iterator[None]:
@@ -115,18 +148,12 @@ class TaggedBlockWriter:
         Within this block, other writes are accumulated, so that the
         whole block can be written out with its length at the end.
         """
-        previous_data = self.data
-        subblock_buf = BytesIO()
-        subblock_data = DataStream(subblock_buf)
-        try:
-            self.data = subblock_data
+        with self._buffered():
+            self.data.write_tag(index, TagType.Length4)
+            length_pos = self._reserve(_SUBBLOCK_LENGTH.size)
             yield
-        finally:
-            self.data = previous_data
-
-        self.data.write_tag(index, TagType.Length4)
-        self.data.write_uint32(len(subblock_buf.getbuffer()))
-        self.data.write_bytes(subblock_buf.getbuffer())
+            length = self.data.tell() - length_pos - _SUBBLOCK_LENGTH.size
+            _SUBBLOCK_LENGTH.pack_into(self._buffer, length_pos, length)
 
     ## Higher level constructs
 